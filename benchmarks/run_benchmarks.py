@@ -0,0 +1,257 @@
+"""
+Reproducible benchmarks for the detect -> fit pipeline.
+
+    python benchmarks/run_benchmarks.py --output new.json
+    python benchmarks/run_benchmarks.py --quick --compare old.json
+    python benchmarks/run_benchmarks.py --quick --import-budget 0.5
+
+Every benchmark is seeded and the GA runs against a deterministic in-process LLM stub, so two result
+files from different versions of the code can be compared directly.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import cv2
+import numpy as np
+from function import Function, generate_random_equation
+from detectobject import DetectObject
+from geneticalgo import GeneticAlgorithm
+from callm import AsyncLLM
+
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "median": statistics.median(times), "repeat": repeat}
+
+
+class StubTransport:
+    """
+    deterministic stand-in for the chat completion API: initial generations are seeded random programs,
+    mutations are drawn from a fixed vocabulary at index 1, which is always valid. Supports n= sampling and
+    numbered replies to batched mutation prompts.
+    """
+    MUTATIONS = [
+        "add_instruction(1, 'y = y + {value}')",
+        "add_instruction(1, 'y = y * {value}')",
+        "substitute_instruction(1, 'y = y - {value}')",
+        "substitute_instruction(1, 'y = y / {value}')",
+    ]
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    async def __call__(self, model, messages, n=1):
+        self.calls += 1
+        replies = [self.reply(messages[1]["content"]) for _ in range(n)]
+        return replies[0] if n == 1 else replies
+
+    def reply(self, content):
+        if content.startswith("The list of numbers is"):
+            state = random.getstate()
+            random.seed(self.random.random())
+            instructions = generate_random_equation().instructions
+            random.setstate(state)
+            return str(instructions)
+        functions = len(re.findall(r"^Function \d+:$", content, re.MULTILINE))
+        if functions:
+            return "\n".join(f"{number}: {self.mutation()}" for number in range(1, functions + 1))
+        return self.mutation()
+
+    def mutation(self):
+        return self.random.choice(self.MUTATIONS).format(value=self.random.randint(1, 10))
+
+
+def bench_function(points, programs, repeat):
+    random.seed(0)
+    functions = [generate_random_equation() for _ in range(programs)]
+    x_values = list(range(1, points + 1))
+    desired_output = [float(3 * x + 5) for x in x_values]
+    outputs = [func.calculate(x_values) for func in functions]
+
+    def calculate():
+        for func in functions:
+            Function(list(func.instructions), func.expression).calculate(x_values)
+
+    def evaluate_similarity():
+        for func, result in zip(functions, outputs):
+            func.evaluate_similarity(result, desired_output)
+
+    params = {"points": points, "programs": programs}
+    return {
+        "function.calculate": dict(measure(calculate, repeat), **params),
+        "function.evaluate_similarity": dict(measure(evaluate_similarity, repeat), **params),
+    }
+
+
+def bench_reorder(object_counts, frames, repeat):
+    results = {}
+    for count in object_counts:
+        rng = random.Random(count)
+        base = [(rng.uniform(0, 1920), rng.uniform(0, 1080)) for _ in range(count)]
+        detections = []
+        for frame in range(frames):
+            points = [(x + rng.uniform(-3, 3), y + rng.uniform(-3, 3)) for x, y in base]
+            rng.shuffle(points)
+            detections.append(points)
+
+        def reorder():
+            DetectObject.fill_and_reorder_lists([list(points) for points in detections])
+
+        results[f"fill_and_reorder_lists.objects_{count}"] = dict(measure(reorder, repeat), objects=count, frames=frames)
+    return results
+
+
+def render_frames(count, width, height, circles, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform([60, 60], [width - 60, height - 60], size=(circles, 2))
+    velocities = rng.uniform(-4, 4, size=(circles, 2))
+    frames = []
+    for index in range(count):
+        frame = np.full((height, width, 3), 255, np.uint8)
+        for (x, y), (dx, dy) in zip(centers, velocities):
+            cv2.circle(frame, (int(x + dx * index), int(y + dy * index)), 25, (0, 0, 0), -1)
+        frames.append(frame)
+    return frames
+
+
+def bench_detect(count, width, height, circles, workers, repeat, tracking=None):
+    frames = render_frames(count, width, height, circles)
+    detector = DetectObject()
+
+    def detect():
+        detector.detect_images(frames, ["circle"], workers=workers, tracking=tracking)
+
+    timing = measure(detect, repeat)
+    timing["frames_per_second"] = count / timing["best"]
+    name = "detect_circles.tracking" if tracking else f"detect_circles.workers_{workers}"
+    return {name: dict(timing, frames=count, width=width, height=height, circles=circles)}
+
+
+def bench_genetic_algorithm(points, population_size, generations, repeat, batch_size=1):
+    x_values = list(range(1, points + 1))
+    desired_output = [float(0.5 * x * x + 3) for x in x_values]
+    transports = []
+
+    def run():
+        random.seed(0)
+        transport = StubTransport(seed=0)
+        transports.append(transport)
+        ga = GeneticAlgorithm(x_values, desired_output, population_size, generations,
+                              llm=AsyncLLM(transport, retries=0, batch_size=batch_size))
+        run.score = ga.run().score
+
+    timing = measure(run, repeat)
+    name = f"genetic_algorithm.run.batch_{batch_size}" if batch_size > 1 else "genetic_algorithm.run"
+    return {name: dict(timing, points=points, population_size=population_size, generations=generations,
+                       llm_calls=transports[-1].calls, best_score=run.score)}
+
+
+IMPORT_MODULES = ["function", "geneticalgo", "callm", "detectobject"]
+
+
+def bench_imports(repeat):
+    """
+    time importing each module in a fresh interpreter, as a worker process would on spawn
+    """
+    results = {}
+    for module in IMPORT_MODULES:
+        code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+        times = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+            times.append(float(output.stdout.strip().splitlines()[-1]))
+        results[f"import.{module}"] = {"best": min(times), "median": statistics.median(times), "repeat": repeat}
+    return results
+
+
+def check_import_budget(results, budget):
+    over = {name: result["best"] for name, result in results.items()
+            if name.startswith("import.") and result["best"] > budget}
+    for name, seconds in over.items():
+        print(f"{name} took {seconds:.3f}s, over the {budget:.3f}s import budget", file=sys.stderr)
+    return not over
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_all(quick):
+    repeat = 3 if quick else 7
+    results = {}
+    results.update(bench_imports(repeat))
+    results.update(bench_function(points=200 if quick else 2000, programs=100 if quick else 500, repeat=repeat))
+    results.update(bench_reorder([2, 4, 8] if quick else [2, 4, 8, 16, 32], frames=100 if quick else 500, repeat=repeat))
+    for workers in (1, 4):
+        results.update(bench_detect(count=20 if quick else 100, width=1280, height=720, circles=4,
+                                    workers=workers, repeat=repeat))
+    results.update(bench_detect(count=20 if quick else 100, width=1280, height=720, circles=4,
+                                workers=None, repeat=repeat, tracking=True))
+    for batch_size in (1, 8):
+        results.update(bench_genetic_algorithm(points=50, population_size=10 if quick else 20,
+                                               generations=3 if quick else 6, repeat=repeat, batch_size=batch_size))
+    return {"environment": environment(), "quick": quick, "results": results}
+
+
+def compare(old, new):
+    print(f"{'benchmark':45s} {'old (s)':>10s} {'new (s)':>10s} {'speedup':>8s}")
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            print(f"{name:45s} {'-':>10s} {result['best']:10.5f} {'-':>8s}")
+        else:
+            print(f"{name:45s} {before['best']:10.5f} {result['best']:10.5f} {before['best'] / result['best']:7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument("--quick", action="store_true", help="smaller problem sizes and fewer repeats")
+    parser.add_argument("--import-budget", type=float,
+                        help="exit with an error if importing any module takes longer than this many seconds")
+    args = parser.parse_args()
+
+    report = run_all(args.quick)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+    if args.import_budget is not None and not check_import_budget(report["results"], args.import_budget):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
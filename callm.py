@@ -1,10 +1,63 @@
-from openai import OpenAI
+import asyncio
+import contextvars
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from instrument import metrics
 
-client = OpenAI(
-    #api_key = "<insert your api_key>",
-)
-def llm_for_mutation(trackinfo):
-    assistant_info = """
+client = None
+
+
+def get_client():
+    """
+    create the OpenAI client on first use, so importing this module stays cheap
+    """
+    global client
+    if client is None:
+        from openai import OpenAI
+        client = OpenAI(
+            #api_key = "<insert your api_key>",
+        )
+    return client
+
+MODEL = "gpt-3.5-turbo"
+
+cache = None  # set to an LLMCache to reuse responses across calls and reruns
+
+_request_counter = contextvars.ContextVar("llm_request_counter", default=None)
+
+
+class RequestCounter:
+    """
+    counts the LLM requests actually sent while it is active: cache hits are not requests, and a batch of
+    mutations or n sampled replies sent as one request counts once. Activation follows the context, so tasks
+    started inside active() are counted too and concurrent runs on one loop or thread pool are counted apart.
+    """
+    def __init__(self, count=0):
+        self.count = count
+
+    @contextmanager
+    def active(self):
+        token = _request_counter.set(self)
+        try:
+            yield self
+        finally:
+            _request_counter.reset(token)
+
+
+def count_request():
+    counter = _request_counter.get()
+    if counter is not None:
+        counter.count += 1
+
+MUTATION_SYSTEM_INFO = "You will be provided with a series of tracking information through genetic algorithms that modify the structure of a function, including the mutation operations of each generation and their corresponding scores(similarity_score). Based on this tracking information, you need to predict the direction of the next mutation (The closer the value of similarity_score is to 1, the more correct the direction of mutation is. I need a function whose score is extremely close to 1)."
+
+MUTATION_ASSISTANT_INFO = """
         Mutation Operations for Symbolic Regression:
 
         We represent mathematical functions using an instruction set. For example:
@@ -39,19 +92,10 @@ def llm_for_mutation(trackinfo):
         Changing ["y = x", "y = y + 3", "y = y^2"] to ["y = x", "y = 3 * y", "y = y^2"]
         transforms the expression from y = (x + 3)^2 to y = (3 * y)^2
         """
-    completion = client.chat.completions.create(
-        model = "gpt-3.5-turbo",
-        messages = [
-            {"role": "system", "content": "You will be provided with a series of tracking information through genetic algorithms that modify the structure of a function, including the mutation operations of each generation and their corresponding scores(similarity_score). Based on this tracking information, you need to predict the direction of the next mutation (The closer the value of similarity_score is to 1, the more correct the direction of mutation is. I need a function whose score is extremely close to 1)."},
-            {"role": "user", "content": "The tracking information is as follows: " + trackinfo},
-            {"role": "assistant", "content": assistant_info}, 
-        ],
-    )
-    response = completion.choices[0].message.content
-    return response
 
-def llm_for_initial_generation(list_of_numbers):
-    assistant_info = """
+INITIAL_GENERATION_SYSTEM_INFO = "You will be provided with a list of numbers where the independent variable is the index and the dependent variable is the corresponding value at that index. Based on this information, you need to generate a function that fits the given data."
+
+INITIAL_GENERATION_ASSISTANT_INFO = """
         Symbolic Regression Task:
         
         Input: A list of numbers where the index is the independent variable (x) and the value is the dependent variable (y).
@@ -75,13 +119,398 @@ def llm_for_initial_generation(list_of_numbers):
 
         Note: Your response should contain nothing but a single list representing the function.
         """
-    completion = client.chat.completions.create(
-        model = "gpt-3.5-turbo",
-        messages = [
-            {"role": "system", "content": "You will be provided with a list of numbers where the independent variable is the index and the dependent variable is the corresponding value at that index. Based on this information, you need to generate a function that fits the given data."},
-            {"role": "user", "content": "The list of numbers is: " + list_of_numbers},
-            {"role": "assistant", "content": assistant_info}, 
-        ],
-    )
+
+
+def mutation_messages(trackinfo):
+    return [
+        {"role": "system", "content": MUTATION_SYSTEM_INFO},
+        {"role": "user", "content": "The tracking information is as follows: " + trackinfo},
+        {"role": "assistant", "content": MUTATION_ASSISTANT_INFO},
+    ]
+
+
+BATCH_MUTATION_FORMAT = """
+        Several functions are listed below, each with its own tracking information. Predict the next mutation for
+        every function independently, and return exactly one line per function, in order, formatted as
+        <function number>: <mutation operation>
+
+        Example response for three functions:
+        1: add_instruction(2, 'y = y + 3')
+        2: remove_instruction(1)
+        3: substitute_instruction(2, 'y = 3 * y')
+        """
+
+_NUMBERED_LINE = re.compile(r"^\s*(?:function\s*)?(\d+)\s*[:.)-]\s*(.+?)\s*$", re.IGNORECASE)
+
+
+def batch_mutation_messages(trackinfos):
+    """
+    one prompt asking for a mutation of every function in trackinfos, sharing the system and assistant text
+    """
+    functions = "\n\n".join(f"Function {number}:\n{trackinfo}" for number, trackinfo in enumerate(trackinfos, 1))
+    return [
+        {"role": "system", "content": MUTATION_SYSTEM_INFO},
+        {"role": "user", "content": BATCH_MUTATION_FORMAT + "\n" + functions},
+        {"role": "assistant", "content": MUTATION_ASSISTANT_INFO},
+    ]
+
+
+def split_batch_reply(reply, count):
+    """
+    demultiplex a reply to batch_mutation_messages into one reply per function; a function the reply skipped
+    gets None. Unnumbered replies with exactly count lines are taken in order.
+    """
+    lines = [line for line in (reply or "").strip().strip('`').splitlines() if line.strip()]
+    replies = {}
+    for line in lines:
+        match = _NUMBERED_LINE.match(line)
+        if match:
+            replies.setdefault(int(match.group(1)), match.group(2))
+    if not replies and len(lines) == count:
+        return [line.strip() for line in lines]
+    return [replies.get(number) for number in range(1, count + 1)]
+
+
+def initial_generation_messages(list_of_numbers):
+    return [
+        {"role": "system", "content": INITIAL_GENERATION_SYSTEM_INFO},
+        {"role": "user", "content": "The list of numbers is: " + list_of_numbers},
+        {"role": "assistant", "content": INITIAL_GENERATION_ASSISTANT_INFO},
+    ]
+
+
+class LLMCache:
+    """
+    content-addressed prompt/response cache stored in SQLite, keyed on the model and the full message list.
+
+    samples_per_key distinct responses are kept for each key; repeated lookups of the same key cycle through
+    them, and a missing sample is a miss, so asking the same prompt population_size times still yields up to
+    samples_per_key different answers. A lookup can also name its sample: llm_for_initial_generations and
+    AsyncLLM.initial_generations ask for samples 0..count-1, so an initial population is always count distinct
+    replies, cached or not, whatever samples_per_key is. Entries older than ttl seconds are ignored, and the
+    least recently used entries are evicted once max_entries or max_bytes is exceeded.
+    """
+    def __init__(self, path="llm_cache.sqlite", samples_per_key=1, ttl=None, max_entries=10000, max_bytes=None):
+        self.path = path
+        self.samples_per_key = samples_per_key
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT, sample INTEGER, response TEXT, size INTEGER, created REAL, accessed REAL, "
+            "PRIMARY KEY (key, sample))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(model, messages):
+        payload = json.dumps([model, messages], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, model, messages, sample=None):
+        """
+        :param sample: the sample to look up; by default the next one in the key's rotation.
+        :return: (key, sample, response); response is None on a miss, and the caller should store() its answer
+                 under the same key and sample.
+        """
+        key = self.make_key(model, messages)
+        with self._lock:
+            if sample is None:
+                count = self._counters.get(key, 0)
+                self._counters[key] = count + 1
+                sample = count % self.samples_per_key
+            row = self._connection.execute(
+                "SELECT response, created FROM responses WHERE key = ? AND sample = ?", (key, sample)
+            ).fetchone()
+            now = time.time()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ? AND sample = ?", (key, sample))
+                self._connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return key, sample, None
+            self._connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ? AND sample = ?", (now, key, sample)
+            )
+            self._connection.commit()
+            self.hits += 1
+            return key, sample, row[0]
+
+    def store(self, key, sample, response):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, sample, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        if self.max_entries is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY accessed DESC "
+                "LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+        if self.max_bytes is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE rowid IN (SELECT rowid FROM ("
+                "SELECT rowid, SUM(size) OVER (ORDER BY accessed DESC) AS total FROM responses) WHERE total > ?)",
+                (self.max_bytes,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+            self._counters.clear()
+
+    def close(self):
+        self._connection.close()
+
+
+def complete(messages, sample=None):
+    if cache is not None:
+        key, sample, response = cache.lookup(MODEL, messages, sample)
+        if response is not None:
+            metrics.count("llm_cache_hits")
+            return response
+    count_request()
+    with metrics.timer("llm_request"):
+        completion = get_client().chat.completions.create(
+            model = MODEL,
+            messages = messages,
+        )
+    record_usage(completion)
     response = completion.choices[0].message.content
+    if cache is not None:
+        cache.store(key, sample, response)
     return response
+
+def llm_for_mutation(trackinfo):
+    return complete(mutation_messages(trackinfo))
+
+def llm_for_initial_generation(list_of_numbers):
+    return complete(initial_generation_messages(list_of_numbers))
+
+def llm_for_initial_generations(list_of_numbers, count):
+    """
+    count initial candidates, the i-th cached as sample i of the prompt like AsyncLLM.initial_generations does
+    """
+    messages = initial_generation_messages(list_of_numbers)
+    for sample in range(count):
+        yield complete(messages, sample)
+
+
+def record_usage(completion):
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        metrics.count("llm_prompt_tokens", usage.prompt_tokens or 0)
+        metrics.count("llm_completion_tokens", usage.completion_tokens or 0)
+
+
+def openai_transport(base_url=None, api_key=None, client=None):
+    """
+    build an async transport backed by one AsyncOpenAI client per event loop, so connections are reused
+    across calls. Point base_url at a local stub server to run without the real API.
+    Called with n > 1 it samples n choices in one request and returns them as a list.
+
+    A client is bound to the loop it first ran on: when the transport is used from a new loop the previous
+    client is closed and replaced. Callers that keep one long-lived loop can pass their own client instead;
+    it is used as is and closing it is left to them.
+    """
+    from openai import AsyncOpenAI
+
+    clients = {}
+
+    async def loop_client():
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            for previous in clients.values():
+                try:
+                    await previous.close()
+                except Exception:  # its connections belong to a loop that may already be closed
+                    pass
+            clients.clear()
+            clients[loop] = AsyncOpenAI(base_url=base_url, api_key=api_key)
+        return clients[loop]
+
+    async def transport(model, messages, n=1):
+        current = client if client is not None else await loop_client()
+        if n == 1:
+            completion = await current.chat.completions.create(model=model, messages=messages)
+        else:
+            completion = await current.chat.completions.create(model=model, messages=messages, n=n)
+        record_usage(completion)
+        if n == 1:
+            return completion.choices[0].message.content
+        return [choice.message.content for choice in completion.choices]
+
+    return transport
+
+
+class AsyncLLM:
+    """
+    concurrent LLM calls with a bounded number of requests in flight, a per-request timeout and
+    retry with exponential backoff. transport is any coroutine function (model, messages) -> str, and cache an
+    optional LLMCache consulted before any request goes out.
+
+    batch_size > 1 packs up to batch_size replies into each request: initial generations are sampled with
+    n=batch_size (the transport must then accept n and return a list), and mutation requests made within
+    batch_window seconds of each other are sent as one numbered-list prompt and split back per function.
+    """
+    def __init__(self, transport=None, concurrency=8, timeout=60.0, retries=3, backoff=1.0, model=MODEL, cache=None,
+                 batch_size=1, batch_window=0.01):
+        self.transport = transport if transport is not None else openai_transport()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.model = model
+        self.cache = cache
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._semaphores = {}
+        self._batches = {}
+        self._timers = {}  # loop -> TimerHandle of the pending batch_window flush
+        self._tasks = set()  # _send_batch tasks in flight; the loop only keeps weak references to them
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores.clear()
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self._semaphores[loop]
+
+    async def complete(self, messages):
+        if self.cache is not None:
+            key, sample, response = self.cache.lookup(self.model, messages)
+            if response is not None:
+                metrics.count("llm_cache_hits")
+                return response
+            response = await self._request(messages)
+            self.cache.store(key, sample, response)
+            return response
+        return await self._request(messages)
+
+    async def _request(self, messages, n=1):
+        semaphore = self._semaphore()
+        for attempt in range(self.retries + 1):
+            try:
+                async with semaphore:
+                    count_request()
+                    with metrics.timer("llm_request"):
+                        if n == 1:
+                            return await asyncio.wait_for(self.transport(self.model, messages), self.timeout)
+                        replies = await asyncio.wait_for(self.transport(self.model, messages, n=n), self.timeout)
+                if len(replies) != n:
+                    raise ValueError(f"Expected {n} choices, got {len(replies)}")
+                return replies
+            except Exception:
+                if attempt == self.retries:
+                    metrics.count("llm_failures")
+                    raise
+                metrics.count("llm_retries")
+            await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    async def samples(self, messages, count):
+        """
+        count replies to the same prompt, the i-th cached as sample i, requesting the ones the cache does not
+        have batch_size at a time
+        """
+        replies = [None] * count
+        missing = []
+        for index in range(count):
+            if self.cache is None:
+                missing.append((index, None, None))
+                continue
+            key, sample, response = self.cache.lookup(self.model, messages, index)
+            if response is None:
+                missing.append((index, key, sample))
+            else:
+                metrics.count("llm_cache_hits")
+                replies[index] = response
+        chunks = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        results = await asyncio.gather(*(self._request(messages, n=len(chunk)) for chunk in chunks))
+        for chunk, result in zip(chunks, results):
+            for (index, key, sample), response in zip(chunk, [result] if len(chunk) == 1 else result):
+                replies[index] = response
+                if self.cache is not None:
+                    self.cache.store(key, sample, response)
+        return replies
+
+    async def mutation(self, trackinfo):
+        if self.batch_size <= 1:
+            return await self.complete(mutation_messages(trackinfo))
+        if self.cache is not None:
+            key, sample, response = self.cache.lookup(self.model, mutation_messages(trackinfo))
+            if response is not None:
+                metrics.count("llm_cache_hits")
+                return response
+        loop = asyncio.get_running_loop()
+        if loop not in self._batches:
+            self._batches.clear()
+            self._timers.clear()
+            self._batches[loop] = []
+        batch = self._batches[loop]
+        future = loop.create_future()
+        batch.append((trackinfo, future))
+        if len(batch) >= self.batch_size:
+            self._flush_batch(loop)
+        elif len(batch) == 1:
+            self._timers[loop] = loop.call_later(self.batch_window, self._flush_batch, loop)
+        response = await future
+        if self.cache is not None and response is not None:
+            self.cache.store(key, sample, response)
+        return response
+
+    def _flush_batch(self, loop):
+        timer = self._timers.pop(loop, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._batches.get(loop)
+        if batch:
+            self._batches[loop] = []
+            task = loop.create_task(self._send_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch):
+        """
+        one request for every mutation in batch; each waiting caller gets its own line of the reply,
+        or None if the reply skipped it
+        """
+        trackinfos = [trackinfo for trackinfo, _ in batch]
+        try:
+            if len(batch) == 1:
+                replies = [await self._request(mutation_messages(trackinfos[0]))]
+            else:
+                replies = split_batch_reply(await self._request(batch_mutation_messages(trackinfos)), len(batch))
+                metrics.count("llm_batched_mutations", len(batch))
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), reply in zip(batch, replies):
+            if not future.done():
+                future.set_result(reply)
+
+    async def initial_generation(self, list_of_numbers):
+        return await self.complete(initial_generation_messages(list_of_numbers))
+
+    async def mutations(self, trackinfos):
+        return await asyncio.gather(*(self.mutation(trackinfo) for trackinfo in trackinfos))
+
+    async def initial_generations(self, list_of_numbers, count):
+        return await self.samples(initial_generation_messages(list_of_numbers), count)
@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import random
+import types
+import numpy as np
+
+
+def save_checkpoint(path, state):
+    """
+    write state as a gzip-compressed pickle, atomically: a crash mid-write leaves the previous checkpoint intact
+    """
+    temporary = f"{path}.tmp"
+    with gzip.open(temporary, "wb", compresslevel=5) as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path):
+    """
+    :return: the saved state, or None if there is no checkpoint at path
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with gzip.open(path, "rb") as file:
+        return pickle.load(file)
+
+
+def describe_option(value):
+    """
+    a description of a GA option that is the same in every process: plain values as they are, arrays by
+    content, named functions and classes by qualified name and other objects by class and attributes, leaving
+    out random number generator state.
+    :raises ValueError: for values with no stable description, such as lambdas and nested functions
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [describe_option(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): describe_option(item) for key, item in sorted(value.items(), key=lambda item: str(item[0]))}
+    if isinstance(value, np.ndarray):
+        content = hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+        return ["ndarray", value.dtype.str, list(value.shape), content]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (type, types.FunctionType, types.BuiltinFunctionType)):
+        name = f"{value.__module__}.{value.__qualname__}"
+        if "<" in name:
+            raise ValueError(f"{name} has no stable description; pass a module-level function instead")
+        return name
+    if isinstance(value, types.MethodType):
+        return [describe_option(value.__self__), value.__name__]
+    if hasattr(value, "__dict__"):
+        attributes = {name: item for name, item in vars(value).items()
+                      if not isinstance(item, (random.Random, np.random.Generator, np.random.RandomState))}
+        return [describe_option(type(value)), describe_option(attributes)]
+    raise ValueError(f"{type(value).__name__} option has no stable description")
+
+
+def job_fingerprint(job, ga_options):
+    """
+    a short hash of everything that decides a job's fit: its time_value, desired_output and mask and the GA
+    options, so a stored result or checkpoint is only reused for the same data and settings.
+    :return: the fingerprint, or None when an option has no stable description (see describe_option)
+    """
+    digest = hashlib.sha256()
+    for name in ("time_value", "desired_output", "mask"):
+        value = job.get(name)
+        digest.update(name.encode())
+        if value is not None:
+            value = np.ascontiguousarray(value, dtype=bool if name == "mask" else float)
+            digest.update(repr(value.shape).encode() + value.tobytes())
+    try:
+        options = describe_option(ga_options)
+    except ValueError:
+        return None
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+class ResultStore:
+    """
+    finished (object, axis) fit results, appended one JSON line at a time so completed work survives a crash.
+    A job counts as finished only when its stored result carries the job's fingerprint.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.finished = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    self.finished[(result["object"], result["axis"])] = result
+
+    def is_finished(self, job):
+        result = self.finished.get((job["object"], job["axis"]))
+        return result is not None and job.get("fingerprint") is not None and result.get("fingerprint") == job["fingerprint"]
+
+    def add(self, result):
+        record = dict(result, track_str_infor=[str(track) for track in result["track_str_infor"]])
+        with open(self.path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self.finished[(record["object"], record["axis"])] = record
+        return record
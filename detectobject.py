@@ -1,12 +1,95 @@
 import cv2
 import numpy as np
 from collections import defaultdict
-from itertools import permutations
-from scipy.spatial.distance import euclidean
-import pandas as pd
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import islice
+from instrument import metrics, reset_metrics
+
+
+def _detect_chunk(detector, images, shape_types, collect_metrics=False):
+    """
+    with collect_metrics (in a worker process) also return the worker's metrics for the parent to merge
+    """
+    results = [detector.detect_shapes_in_image(image, shape_types) for image in images]
+    if collect_metrics:
+        return results, metrics.drain()
+    return results
+
+
+def load_image(image):
+    """
+    accept either a path or an already decoded BGR frame
+    """
+    if isinstance(image, str):
+        with metrics.timer("frame_decode"):
+            return cv2.imread(image)
+    return image
+
+
+class CircleTracker:
+    """
+    circle detection for consecutive video frames. A full-frame Hough pass finds the circles on the
+    first frame, on every keyframe_interval-th frame and whenever a track is lost; in between, each
+    circle is searched for only in a window of its previous radius plus roi_margin pixels around its
+    previous center. downscale < 1 runs every Hough pass on a proportionally resized image.
+    """
+    def __init__(self, detector, keyframe_interval=30, roi_margin=20, downscale=1.0):
+        self.detector = detector
+        self.keyframe_interval = keyframe_interval
+        self.roi_margin = roi_margin
+        self.downscale = downscale
+        self.previous = None
+        self.frame_index = 0
+        self.full_detections = 0
+        self.roi_detections = 0
+
+    def _search_rois(self, image):
+        height, width = image.shape[:2]
+        found = []
+        for x, y, r in self.previous:
+            half = int(r + self.roi_margin)
+            left, top = max(int(x) - half, 0), max(int(y) - half, 0)
+            right, bottom = min(int(x) + half + 1, width), min(int(y) + half + 1, height)
+            roi = cv2.cvtColor(image[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
+            circles = self.detector.hough_circles(roi, self.downscale, minDist=2 * half)
+            if len(circles) == 0:
+                return None
+            circles[:, 0] += left
+            circles[:, 1] += top
+            found.append(circles[np.argmin(np.hypot(circles[:, 0] - x, circles[:, 1] - y))])
+        found = np.array(found).reshape(-1, 3)
+        # two tracks that converged on the same circle mean one object was lost
+        for i in range(len(found)):
+            distances = np.hypot(found[i + 1:, 0] - found[i, 0], found[i + 1:, 1] - found[i, 1])
+            if np.any(distances < self.detector.HOUGH_PARAMS['minDist']):
+                return None
+        return found
+
+    def update(self, image):
+        """
+        :return: the circle centers in this frame, in the same format as DetectObject.detect_circles.
+        """
+        image = load_image(image)
+        circles = None
+        keyframe = self.keyframe_interval and self.frame_index % self.keyframe_interval == 0
+        if self.previous is not None and len(self.previous) and not keyframe:
+            circles = self._search_rois(image)
+            if circles is not None:
+                self.roi_detections += 1
+        if circles is None:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            circles = self.detector.hough_circles(gray, self.downscale)
+            self.full_detections += 1
+        self.previous = circles
+        self.frame_index += 1
+        return [(x, y) for (x, y, r) in np.round(circles).astype("int")]
+
 
 class DetectObject:
+    HOUGH_PARAMS = dict(dp=1.2, minDist=30, param1=50, param2=30, minRadius=15, maxRadius=50)
+
     def __init__(self):
         self.detectors = {
             'circle': self.detect_circles,
@@ -37,28 +120,34 @@ class DetectObject:
         return result
 
     @staticmethod
-    def fill_and_reorder_lists(nested_lists, pad_value=(0, 0)):
+    def fill_and_reorder_lists(nested_lists, pad_value=(0, 0), reference='max', return_mask=False):
+        """
+        pad every frame to the largest detection count and reorder each frame's detections so that
+        index j is the same object in every frame.
+        reference='max' matches every frame against the frame with the most detections;
+        reference='previous' walks outwards from that frame and matches each frame against the
+        last known position of every object in its neighbouring frame.
+        With return_mask, also return a (frames x objects) boolean array that is False wherever a position was
+        padded or interpolated rather than detected.
+        """
+        from scipy.optimize import linear_sum_assignment
+        from scipy.spatial.distance import cdist
+
         def average_tuples(tuple1, tuple2):
                 return ((tuple1[0] + tuple2[0]) / 2, (tuple1[1] + tuple2[1]) / 2)
             
         def reorder(base_list, list2):
-            def total_distance(based_list, list2):
-                def euclidean_distance(p1, p2):
-                    return np.sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
-            
-                return sum(euclidean_distance(p1, p2) for p1, p2 in zip(based_list, list2))
-            
-            all_permutations = permutations(list2)
-            min_distance = float('inf')
-            best_permutation = None
-
-            for perm in all_permutations:
-                dist = total_distance(base_list, perm)
-                if dist < min_distance:
-                    min_distance = dist
-                    best_permutation = perm
-
-            return list(best_permutation)
+            # optimal assignment (Hungarian) on the pairwise distance matrix, same objective as trying every permutation
+            # padding is not a detection: only real points are matched, the padding fills the slots left over
+            points = [point for point in list2 if point != pad_value]
+            if not points:
+                return list2
+            distances = cdist(np.asarray(points, dtype=float), np.asarray(base_list, dtype=float))
+            rows, cols = linear_sum_assignment(distances)
+            best_order = [pad_value] * len(base_list)
+            for row, col in zip(rows, cols):
+                best_order[col] = points[row]
+            return best_order
             
         max_length = 0
         max_index = -1
@@ -78,19 +167,43 @@ class DetectObject:
         results = [None] * len(padded_lists)
         results[max_index] = padded_lists[max_index]
 
-        for i in range(0, len(padded_lists)):
-            if i != max_index:
-                padded_lists[i] = reorder(padded_lists[max_index], padded_lists[i])
-            else:
-                i += 1
-        # substitute (0, 0) with the average of the two adjacent tuples    
-        for i in range(0, len(padded_lists)):
-            for j in range(0, len(padded_lists[i])):
-                if padded_lists[i][j] == (0, 0):
-                    if i == 1:
-                        padded_lists[i][j] = padded_lists[i + 1][j] 
-                    else:
-                        padded_lists[i][j] = average_tuples(padded_lists[i - 1][j], padded_lists[i + 1][j])
+        if reference == 'max':
+            for i in range(0, len(padded_lists)):
+                if i != max_index:
+                    padded_lists[i] = reorder(padded_lists[max_index], padded_lists[i])
+        elif reference == 'previous':
+            for step in (1, -1):
+                anchor = padded_lists[max_index]
+                i = max_index + step
+                while 0 <= i < len(padded_lists):
+                    padded_lists[i] = reorder(anchor, padded_lists[i])
+                    anchor = [anchor[j] if point == pad_value else point for j, point in enumerate(padded_lists[i])]
+                    i += step
+        else:
+            raise ValueError(f"Unsupported reference: {reference}")
+        if return_mask:
+            mask = np.array([[point != pad_value and point != (0, 0) for point in inner_list] for inner_list in padded_lists],
+                            dtype=bool).reshape(len(padded_lists), max_length)
+        # substitute a missing position with the average of the nearest detected positions before and after it,
+        # or with the nearest detected one in the first and last frames
+        missing = [[point == pad_value or point == (0, 0) for point in inner_list] for inner_list in padded_lists]
+        for j in range(max_length):
+            detected = [i for i in range(len(padded_lists)) if not missing[i][j]]
+            if not detected:
+                continue
+            for i in range(len(padded_lists)):
+                if not missing[i][j]:
+                    continue
+                before = max((k for k in detected if k < i), default=None)
+                after = min((k for k in detected if k > i), default=None)
+                if before is None:
+                    padded_lists[i][j] = padded_lists[after][j]
+                elif after is None:
+                    padded_lists[i][j] = padded_lists[before][j]
+                else:
+                    padded_lists[i][j] = average_tuples(padded_lists[before][j], padded_lists[after][j])
+        if return_mask:
+            return padded_lists, mask
         return padded_lists
     
     def reorganize_object_coordinates(self, input_list):
@@ -126,62 +239,175 @@ class DetectObject:
         helper(lst)
         return lst
     
-    def row_data(self, input_list):
-        row_data = self.reorganize_object_coordinates(input_list)
-        time_sequence = self.time_sequence(self.reorganize_object_coordinates(input_list))
+    @staticmethod
+    def positions_array(input_list, path=None, chunk=4096):
+        """
+        turn fill_and_reorder_lists output into one (frames x objects x 2) float array of x, y positions.
+        With path, the array is a memory-mapped .npy file that can be reopened later or shared with worker
+        processes; it is filled chunk frames at a time, so no second full-size copy is built in RAM on the way.
+        The nested lists themselves are still in memory: the caller holds every frame's detections anyway.
+        """
+        if isinstance(input_list, np.ndarray) and path is None:
+            return input_list
+        frames = len(input_list)
+        objects = len(input_list[0]) if frames else 0
+        if path is None:
+            positions = np.empty((frames, objects, 2))
+        else:
+            positions = np.lib.format.open_memmap(path, mode='w+', dtype=float, shape=(frames, objects, 2))
+        if frames and objects:
+            for start in range(0, frames, chunk):
+                positions[start:start + chunk] = input_list[start:start + chunk]
+        return positions
+
+    @staticmethod
+    def trajectory_views(positions):
+        """
+        per-object [x, y] views into a positions array (no copies) and the shared 1..N frame numbers
+        """
+        times = np.arange(1, len(positions) + 1, dtype=float)
+        row_data = [[positions[:, obj, 0], positions[:, obj, 1]] for obj in range(positions.shape[1])]
+        time_sequence = [[times, times] for _ in range(positions.shape[1])]
         return row_data, time_sequence
+
+    def row_data(self, input_list):
+        return self.trajectory_views(self.positions_array(input_list))
     
-    def detect_shapes_in_image(self, image_path, shape_types):
+    def detect_shapes_in_image(self, image, shape_types):
         """
-        detect multiple shapes in a single image
+        detect multiple shapes in a single image (a path or a decoded frame)
         """
+        image = load_image(image)
         results = {}
         for shape in shape_types:
             if shape not in self.detectors:
                 raise ValueError(f"Unsupported shape type: {shape}")
-            results[shape] = self.detectors[shape](image_path)
+            results[shape] = self.detectors[shape](image)
         return results
 
-    def detect(self, image_paths, shape_types):
+    def iter_detections(self, images, shape_types, workers=None, chunksize=16, use_processes=False, tracking=None):
+        """
+        run detect_shapes_in_image over paths or frames from any iterable (e.g. a framesource.VideoSource),
+        yielding results in input order as they complete.
+        With workers > 1 the input is split into chunks of chunksize and spread over a thread pool
+        (OpenCV releases the GIL) or, with use_processes, a process pool. At most 2 * workers chunks are
+        in flight, so a streaming source is consumed only as fast as detection keeps up.
+        tracking (True or a dict of CircleTracker options) detects circles frame to frame with a
+        CircleTracker instead; it depends on the previous frame, so it always runs sequentially.
+        """
+        images = iter(images)
+        if tracking:
+            if workers and workers > 1:
+                raise ValueError("tracking mode is sequential and cannot use workers")
+            tracker = CircleTracker(self, **(tracking if isinstance(tracking, dict) else {}))
+            for image in images:
+                image = load_image(image)
+                results = {}
+                for shape in shape_types:
+                    if shape not in self.detectors:
+                        raise ValueError(f"Unsupported shape type: {shape}")
+                    results[shape] = tracker.update(image) if shape == 'circle' else self.detectors[shape](image)
+                yield results
+            return
+        if not workers or workers <= 1:
+            for image in images:
+                yield self.detect_shapes_in_image(image, shape_types)
+            return
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=reset_metrics)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+        with executor:
+            pending = deque()
+            while True:
+                while len(pending) < 2 * workers:
+                    chunk = list(islice(images, chunksize))
+                    if not chunk:
+                        break
+                    pending.append(executor.submit(_detect_chunk, self, chunk, shape_types, use_processes))
+                if not pending:
+                    return
+                results = pending.popleft().result()
+                if use_processes:
+                    results, worker_metrics = results
+                    metrics.merge(worker_metrics)
+                yield from results
+
+    def detect_images(self, images, shape_types, workers=None, chunksize=16, use_processes=False, tracking=None):
+        return list(self.iter_detections(images, shape_types, workers, chunksize, use_processes, tracking))
+
+    def detect(self, image_paths, shape_types, workers=None, chunksize=16, use_processes=False, reference='max',
+               tracking=None, as_array=False, memmap_dir=None, return_masks=False):
         """
-        detect multiple shapes in multiple images
+        detect multiple shapes in multiple images; image_paths may be any iterable of paths or decoded frames.
+        With as_array each shape maps to a (frames x objects x 2) array instead of nested lists, memory-mapped
+        to <memmap_dir>/<shape>.npy when memmap_dir is given. Every frame's detections are still collected and
+        reordered in memory first (reference='max' needs the whole video), so memmap_dir saves the later copies
+        of the positions, not the peak memory of detection.
+        With return_masks, return (results, masks) where masks maps each shape to the (frames x objects) boolean
+        array from fill_and_reorder_lists marking the detected, not padded or interpolated, positions.
         """
         results = defaultdict(list)
+        masks = {}
         
-        for path in image_paths:
-            image_results = self.detect_shapes_in_image(path, shape_types)
+        for image_results in self.iter_detections(image_paths, shape_types, workers, chunksize, use_processes, tracking):
             for shape, centers in image_results.items():
                 results[shape].append(centers)
         for shape in results:
-            results[shape] = self.fill_and_reorder_lists(results[shape])
+            with metrics.timer("reorder"):
+                results[shape] = self.fill_and_reorder_lists(results[shape], reference=reference, return_mask=return_masks)
+            if return_masks:
+                results[shape], masks[shape] = results[shape]
+            if as_array or memmap_dir:
+                path = os.path.join(memmap_dir, f"{shape}.npy") if memmap_dir else None
+                results[shape] = self.positions_array(results[shape], path)
+        if return_masks:
+            return dict(results), masks
         return dict(results)
         
-    def detect_circles(self, image_path):
+    def hough_circles(self, gray, scale=1.0, **overrides):
+        """
+        blur and run HoughCircles on a grayscale image, optionally resized by scale first.
+        :return: an (n, 3) array of x, y, r in the coordinates of the unscaled image.
+        """
+        params = dict(self.HOUGH_PARAMS, **overrides)
+        if scale != 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            for key in ('minDist', 'minRadius', 'maxRadius'):
+                params[key] = max(1, int(round(params[key] * scale)))
+        with metrics.timer("hough_detection"):
+            gray = cv2.GaussianBlur(gray, (9, 9), 2)
+            circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, **params)
+        if circles is None:
+            return np.empty((0, 3))
+        return circles[0, :] / scale
+
+    def detect_circles(self, image):
         """
         detect_one_circle
         """
-        image = cv2.imread(image_path)
+        image = load_image(image)
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (9, 9), 2)
-        circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, dp=1.2, minDist=30, param1=50, param2=30, minRadius=15, maxRadius=50)
+        circles = self.hough_circles(gray)
 
         circle_centers = []
-        if circles is not None:
-            circles = np.round(circles[0, :]).astype("int")
-            for (x, y, r) in circles:
-                circle_centers.append((x, y))
+        circles = np.round(circles).astype("int")
+        for (x, y, r) in circles:
+            circle_centers.append((x, y))
         return circle_centers
     
-    def detect_squares(self, image_path):
+    def detect_squares(self, image):
         pass
     
-    def detect_triangles(self, image_path):
+    def detect_triangles(self, image):
         pass
     
-    def detect_rectangles(self, image_path):
+    def detect_rectangles(self, image):
         pass
     
 if __name__ == "__main__":
+    import pandas as pd
+
     def get_image_paths(folder_path):
         if not os.path.exists(folder_path):
             raise ValueError(f"The folder path {folder_path} does not exist.")
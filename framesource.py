@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+import cv2
+from instrument import metrics
+
+
+def get_image_paths(folder_path):
+    if not os.path.exists(folder_path):
+        raise ValueError(f"The folder path {folder_path} does not exist.")
+
+    all_files = os.listdir(folder_path)
+    image_files = [f for f in all_files if f.endswith('.jpg') or f.endswith('.png') or f.endswith('.jpeg')]
+    image_files.sort()
+    image_paths = [os.path.join(folder_path, f) for f in image_files]
+
+    return image_paths
+
+
+class ImageFolderSource:
+    """
+    frames stored as individual image files; yields the paths and leaves decoding to the detector
+    """
+    def __init__(self, folder_path, start=0, end=None, stride=1):
+        self.image_paths = get_image_paths(folder_path)[start:end:stride]
+
+    def __iter__(self):
+        return iter(self.image_paths)
+
+    def __len__(self):
+        return len(self.image_paths)
+
+
+class VideoSource:
+    """
+    decode frames straight from a video file with cv2.VideoCapture.
+
+    Frames in [start, end) are read every stride frames; skipped frames are only grabbed, not decoded.
+    A background thread keeps up to prefetch decoded frames in a bounded queue, so detection can start
+    before decoding finishes and memory stays bounded however long the clip is.
+    """
+    _END = object()
+
+    def __init__(self, video_path, start=0, end=None, stride=1, prefetch=32):
+        if not os.path.exists(video_path):
+            raise ValueError(f"The video path {video_path} does not exist.")
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        self.video_path = video_path
+        self.start = start
+        self.end = end
+        self.stride = stride
+        self.prefetch = prefetch
+
+    def read_frames(self):
+        """
+        decode the selected frames in the calling thread
+        """
+        capture = cv2.VideoCapture(self.video_path)
+        if not capture.isOpened():
+            raise ValueError(f"Cannot open video {self.video_path}")
+        try:
+            if self.start:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+            index = self.start
+            while self.end is None or index < self.end:
+                with metrics.timer("frame_decode"):
+                    ok, frame = capture.read()
+                if not ok:
+                    return
+                yield frame
+                index += 1
+                for _ in range(self.stride - 1):
+                    if (self.end is not None and index >= self.end) or not capture.grab():
+                        return
+                    index += 1
+        finally:
+            capture.release()
+
+    def __iter__(self):
+        if not self.prefetch:
+            yield from self.read_frames()
+            return
+        frames = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for frame in self.read_frames():
+                    if not put(frame):
+                        return
+                put(self._END)
+            except Exception as error:
+                put(error)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is self._END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+
+def open_source(path, **options):
+    """
+    pick a frame source for a folder of frames or a video file
+    """
+    if os.path.isdir(path):
+        return ImageFolderSource(path, **{k: v for k, v in options.items() if k in ('start', 'end', 'stride')})
+    return VideoSource(path, **options)
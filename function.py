@@ -1,8 +1,248 @@
 import random
-import math
 import re
 import ast
-import sys
+from collections import defaultdict
+import numpy as np
+from history import MutationHistory, TrackContext, TrackRecord
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_BINARY_PATTERN = re.compile(r'^y([-+*/^])(' + _NUMBER + r')$')
+_REVERSED_PATTERN = re.compile(r'^(' + _NUMBER + r')([-+*/])y$')
+_UNARY_PATTERN = re.compile(r'^(ln|log|sin|cos)\(y\)$')
+_CONSTANT_PATTERN = re.compile(r'^' + _NUMBER + r'$')
+
+_BINARY_OPCODES = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'div', '^': 'pow'}
+_REVERSED_OPCODES = {'+': 'add', '-': 'rsub', '*': 'mul', '/': 'rdiv'}
+
+_OPERATIONS = {
+    'add': lambda y, c: y + c,
+    'sub': lambda y, c: y - c,
+    'mul': lambda y, c: y * c,
+    'div': lambda y, c: y / c,
+    'pow': lambda y, c: np.power(y, c),
+    'rsub': lambda y, c: c - y,
+    'rdiv': lambda y, c: c / y,
+    'ln': lambda y, c: np.log(np.where(y > 0, y, np.nan)),
+    'log': lambda y, c: np.log10(np.where(y > 0, y, np.nan)),
+    'sin': lambda y, c: np.sin(y),
+    'cos': lambda y, c: np.cos(y),
+    'const': lambda y, c: np.full(y.shape, c),
+}
+
+
+def compile_instruction(instruction):
+    """
+    parse one formatted instruction such as 'y = y + 3' into an (opcode, constant) step
+    """
+    lhs, sep, rhs = instruction.partition('=')
+    if not sep or lhs.strip() != 'y':
+        raise ValueError(f"Invalid instruction: {instruction}")
+    rhs = rhs.replace(' ', '')
+    match = _BINARY_PATTERN.match(rhs)
+    if match:
+        return (_BINARY_OPCODES[match.group(1)], float(match.group(2)))
+    match = _REVERSED_PATTERN.match(rhs)
+    if match:
+        return (_REVERSED_OPCODES[match.group(2)], float(match.group(1)))
+    match = _UNARY_PATTERN.match(rhs)
+    if match:
+        return (match.group(1), None)
+    if _CONSTANT_PATTERN.match(rhs):
+        return ('const', float(rhs))
+    raise ValueError(f"Invalid instruction: {instruction}")
+
+
+def execute_program(program, x_values):
+    """
+    run a compiled program over the whole x vector at once
+    """
+    y = np.asarray(x_values, dtype=float)
+    with np.errstate(all='ignore'):
+        for opcode, constant in program:
+            y = _OPERATIONS[opcode](y, constant)
+    return y
+
+
+def execute_programs(programs, x_values):
+    """
+    run a whole population of compiled programs over a shared x vector in one batched pass,
+    one row of the returned (programs x points) matrix per program
+    """
+    x = np.asarray(x_values, dtype=float)
+    y = np.tile(x, (len(programs), 1))
+    depth = max((len(program) for program in programs), default=0)
+    with np.errstate(all='ignore'):
+        for step in range(depth):
+            groups = defaultdict(lambda: ([], []))
+            for row, program in enumerate(programs):
+                if step < len(program):
+                    opcode, constant = program[step]
+                    rows, constants = groups[opcode]
+                    rows.append(row)
+                    constants.append(0.0 if constant is None else constant)
+            for opcode, (rows, constants) in groups.items():
+                constants = np.array(constants)[:, None]
+                y[rows] = _OPERATIONS[opcode](y[rows], constants)
+    return y
+
+
+def canonical_program(program, digits=10):
+    """
+    a hashable normal form of a compiled program, so equivalent candidates share one fitness cache entry:
+    subtraction and division become addition and multiplication by the inverse constant, constants are
+    rounded to digits significant figures, and identity steps (+0, *1, ^1) are dropped
+    """
+    canonical = []
+    for opcode, constant in program:
+        if opcode == 'sub':
+            opcode, constant = 'add', -constant
+        elif opcode == 'div' and constant != 0:
+            opcode, constant = 'mul', 1 / constant
+        if constant is not None:
+            constant = float(f'{constant:.{digits}g}') + 0.0
+            if (opcode, constant) in (('add', 0.0), ('mul', 1.0), ('pow', 1.0)):
+                continue
+        canonical.append((opcode, constant))
+    return tuple(canonical)
+
+
+SCORE_COLUMNS = ('rmse', 'mae', 'similarity_score')
+
+
+def score_outputs(outputs, desired_output):
+    """
+    score every row of an outputs matrix against desired_output, returning a (rows x SCORE_COLUMNS) matrix
+    """
+    outputs = np.atleast_2d(outputs)
+    diff = outputs - np.asarray(desired_output, dtype=float)
+    rmse = np.sqrt(np.mean(diff ** 2, axis=1))
+    mae = np.mean(np.abs(diff), axis=1)
+    # a program that produces nan anywhere (e.g. ln of a negative) is the least similar, not unorderable
+    similarity_score = np.where(np.isfinite(rmse), 1 / (1 + rmse), 0.0)
+    return np.column_stack([rmse, mae, similarity_score])
+
+
+_AFFINE_OPCODES = ('add', 'sub', 'mul', 'div')
+
+
+def render_instruction(opcode, constant):
+    """
+    turn an (opcode, constant) step back into an instruction string
+    """
+    if constant is not None:
+        constant = constant + 0.0  # no '-0' in the rendered instruction
+    value = f'{constant:.6g}' if constant is not None else None
+    if opcode == 'add':
+        return f'y = y - {-constant:.6g}' if constant < 0 else f'y = y + {value}'
+    if opcode == 'sub':
+        return f'y = y + {-constant:.6g}' if constant < 0 else f'y = y - {value}'
+    if opcode in ('mul', 'div', 'pow'):
+        return f'y = y {dict(mul="*", div="/", pow="^")[opcode]} {value}'
+    if opcode in ('rsub', 'rdiv'):
+        return f'y = {value} {dict(rsub="-", rdiv="/")[opcode]} y'
+    if opcode == 'const':
+        return f'y = {value}'
+    return f'y = {opcode}(y)'
+
+
+def _rmse(program, x, desired):
+    return float(np.sqrt(np.mean((execute_program(program, x) - desired) ** 2)))
+
+
+def _fit_affine_tail(program, start, x, desired):
+    """
+    closed-form least squares for a program whose constants all sit in a trailing run of add/sub/mul/div steps.
+    The run collapses to y = scale * z + shift (z being the output of the steps before it); one multiplicative
+    and one additive step carry the fitted scale and shift and the rest become identities.
+    """
+    with np.errstate(all='ignore'):
+        z = execute_program(program[:start], x)
+    if not np.all(np.isfinite(z)):
+        return None
+    tail = range(start, len(program))
+    multiplicative = [i for i in tail if program[i][0] in ('mul', 'div')]
+    additive = [i for i in tail if program[i][0] in ('add', 'sub')]
+    scale, shift = 1.0, 0.0
+    if multiplicative and additive:
+        try:
+            (scale, intercept), *_ = np.linalg.lstsq(np.column_stack([z, np.ones_like(z)]), desired, rcond=None)
+        except np.linalg.LinAlgError:  # SVD does not converge when z spans too many orders of magnitude
+            return None
+        if additive[-1] > multiplicative[0]:
+            shift = intercept
+        elif scale != 0:
+            shift = intercept / scale
+        else:
+            return None
+    elif additive:
+        shift = float(np.mean(desired - z))
+    elif np.dot(z, z) > 0:
+        scale = float(np.dot(z, desired) / np.dot(z, z))
+    if scale == 0 and multiplicative and program[multiplicative[0]][0] == 'div':
+        return None
+    fitted = list(program)
+    for i in tail:
+        opcode = program[i][0]
+        if opcode in ('mul', 'div'):
+            value = scale if i == (multiplicative[0]) else 1.0
+            fitted[i] = (opcode, value if opcode == 'mul' else 1 / value)
+        else:
+            value = shift if i == additive[-1] else 0.0
+            fitted[i] = (opcode, value if opcode == 'add' else -value)
+    return fitted
+
+
+def _fit_least_squares(program, slots, x, desired, max_nfev):
+    from scipy.optimize import least_squares
+
+    def with_constants(values):
+        trial = list(program)
+        for i, value in zip(slots, values):
+            trial[i] = (trial[i][0], float(value))
+        return trial
+
+    def residuals(values):
+        residual = execute_program(with_constants(values), x) - desired
+        return np.where(np.isfinite(residual), residual, 1e6)
+
+    start = np.array([program[i][1] for i in slots])
+    try:
+        result = least_squares(residuals, start, max_nfev=max_nfev)
+    except (ValueError, np.linalg.LinAlgError):
+        # residuals or their finite-difference Jacobian overflow for programs like y^4^4^3; no fit then
+        return None
+    return with_constants(result.x)
+
+
+def fit_program_constants(program, x_values, desired_output, max_nfev=100, mask=None):
+    """
+    optimise every numeric constant of a compiled program for a fixed structure.
+    Closed form when the constants all sit in an affine tail, scipy least squares otherwise.
+    With mask, only the points where it is True are fitted (e.g. real detections, not padded frames).
+    Returns the fitted program, or None when fitting does not lower the RMSE.
+    """
+    x = np.asarray(x_values, dtype=float)
+    desired = np.asarray(desired_output, dtype=float)
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+        x, desired = x[mask], desired[mask]
+    slots = [i for i, (opcode, constant) in enumerate(program) if constant is not None]
+    if not slots:
+        return None
+    start = len(program)
+    while start > 0 and program[start - 1][0] in _AFFINE_OPCODES:
+        start -= 1
+    with np.errstate(all='ignore'):
+        if slots[0] >= start:
+            fitted = _fit_affine_tail(program, start, x, desired)
+        else:
+            fitted = _fit_least_squares(program, slots, x, desired, max_nfev)
+        if fitted is None:
+            return None
+        before, after = _rmse(program, x, desired), _rmse(fitted, x, desired)
+    if not np.isfinite(after) or (np.isfinite(before) and after >= before):
+        return None
+    return fitted
 
 
 class Function:
@@ -10,9 +250,12 @@ class Function:
         self.instructions = instructions
         self.expression = expression
         self.x_values = []
-        self.track = []
+        self.track = MutationHistory()
         self.score = 0
         self.desired_output = []
+        self.scorer = None  # optional scoring.Scorer; the default scores by RMSE through score_outputs
+        self._program = None
+        self._prefix = []  # y vector after each instruction for the last x_values, so edits only re-run the tail
         
     @classmethod
     def create_from_instructions(cls, instruction_string):
@@ -31,49 +274,96 @@ class Function:
         instance.update_expression()
         return instance
     
+    def compile(self):
+        """
+        parse the instruction list once into (opcode, constant) steps, cached until the next mutation
+        """
+        if self._program is None:
+            self.instructions = [self.format_instruction(instruction) for instruction in self.instructions]
+            self._program = [compile_instruction(instruction) for instruction in self.instructions[1:]]  # Skip the first 'y = x'
+            self._prefix = []
+        return self._program
+
     def calculate(self, x_values):
         self.x_values = x_values
-        y_values = []
-        self.instructions = [self.format_instruction(instruction) for instruction in self.instructions]
-        for x in x_values:
-            y = x
-            for instruction in self.instructions[1:]:  # Skip the first 'y = x'
-                if 'y = y + ' in instruction:
-                    y += float(instruction.split('+')[1])
-                elif 'y = y - ' in instruction:
-                    y -= float(instruction.split('-')[1])
-                elif 'y = y * ' in instruction:
-                    y *= float(instruction.split('*')[1])
-                elif 'y = y / ' in instruction:
-                    y /= float(instruction.split('/')[1])
-                elif 'y = y ^ ' in instruction:
-                    y = y ** float(instruction.split('^')[1])
-                elif 'y = ln(y)' in instruction:
-                    y = math.log(y) if y > 0 else float('nan')
-                elif 'y = sin(y)' in instruction:
-                    y = math.sin(y)
-                elif 'y = cos(y)' in instruction:
-                    y = math.cos(y)
-                else:
-                    y = float(instruction.split('=')[1])
-            y_values.append(y)
-        return y_values
+        program = self.compile()
+        x = np.asarray(x_values, dtype=float)
+        if not self._prefix or not np.array_equal(self._prefix[0], x):
+            self._prefix = [x.copy()]  # a caller editing x_values in place must not leave a stale cache behind
+        with np.errstate(all='ignore'):
+            for opcode, constant in program[len(self._prefix) - 1:]:
+                self._prefix.append(_OPERATIONS[opcode](self._prefix[-1], constant))
+        # a copy, so a caller writing into the result cannot corrupt the cached prefix results
+        return self._prefix[-1].copy()
+
+    def __getstate__(self):
+        # the compiled program and prefix results are caches; leave them out of pickles and checkpoints
+        state = self.__dict__.copy()
+        state['_program'] = None
+        state['_prefix'] = []
+        return state
+
+    def copy(self):
+        """
+        an independent candidate with the same program, score and history
+        """
+        clone = Function(list(self.instructions), self.expression)
+        clone.x_values = self.x_values
+        clone.desired_output = self.desired_output
+        clone.score = self.score
+        clone.scorer = self.scorer
+        clone.track = MutationHistory(self.track, self.track.maxlen, self.track.context)
+        clone._program = list(self._program) if self._program is not None else None
+        clone._prefix = list(self._prefix)
+        return clone
+
+    def fit_constants(self, x_values, desired_output, max_nfev=100):
+        """
+        refit the numeric literals of the current instruction structure to desired_output, on the scorer's
+        masked points only when there is a scorer.
+        :return: True if the instructions were rewritten with better constants.
+        """
+        mask = self.scorer.mask if self.scorer is not None else None
+        fitted = fit_program_constants(self.compile(), x_values, desired_output, max_nfev, mask)
+        if fitted is None:
+            return False
+        old_instructions, old_expression = self.instructions, self.expression
+        old_score = self.evaluate_similarity(self.calculate(x_values), desired_output)["similarity_score"]
+        self.instructions = [self.instructions[0]] + [render_instruction(opcode, constant) for opcode, constant in fitted]
+        self._program = None
+        self.update_expression()
+        new_score = self.evaluate_similarity(self.calculate(x_values), desired_output)["similarity_score"]
+        if new_score < old_score:  # a lower RMSE can still be a worse robust score (e.g. Huber or median error)
+            self.instructions = old_instructions
+            self._program = None
+            self.update_expression()
+            self.score = old_score
+            return False
+        self.track.append(TrackRecord('fit_constants', None, None, None, old_expression, self.expression, old_score, new_score))
+        return True
+
+    def _edited(self, index, step=None, insert=False):
+        """
+        keep the compiled program and the cached prefix results in step with an edit at instruction index,
+        so the next calculate only re-evaluates instructions index..n
+        """
+        if self._program is not None:
+            if insert:
+                self._program.insert(index - 1, step)
+            elif step is None:
+                self._program.pop(index - 1)
+            else:
+                self._program[index - 1] = step
+        del self._prefix[index:]
 
     def evaluate_similarity(self, calculated_values, desired_output): #  (less similar) 0 < similarity_score < 1(most similar)
         self.desired_output = desired_output  
-        squared_diff_sum = sum((calc - desired) ** 2 for calc, desired in zip(calculated_values, desired_output))
-        rmse = math.sqrt(squared_diff_sum / len(calculated_values))
-        
-        abs_diff_sum = sum(abs(calc - desired) for calc, desired in zip(calculated_values, desired_output))
-        mae = abs_diff_sum / len(calculated_values)
-        
-        similarity_score = 1 / (1 + rmse)
-        self.score = similarity_score
-        return {
-            "rmse": rmse,
-            "mae": mae,
-            "similarity_score": similarity_score
-        }
+        if self.scorer is not None:
+            scores = dict(zip(self.scorer.columns, self.scorer(calculated_values, desired_output)[0].tolist()))
+        else:
+            scores = dict(zip(SCORE_COLUMNS, score_outputs(calculated_values, desired_output)[0].tolist()))
+        self.score = scores["similarity_score"]
+        return scores
     
     def add_instruction(self, index, new_instruction):
         old_expression = self.expression
@@ -82,12 +372,13 @@ class Function:
         new_instruction = self.format_instruction(new_instruction)
         if index < 1 or index > len(self.instructions):
             raise IndexError("Instruction index out of range")
+        step = compile_instruction(new_instruction)
         self.instructions.insert(index, new_instruction)
+        self._edited(index, step, insert=True)
         self.update_expression()
         
         new_score = self.evaluate_similarity(self.calculate(self.x_values), self.desired_output)["similarity_score"]
-        score_change = "decreased" if new_score < old_score else "remained the same" if new_score == old_score else "increased"
-        self.track.append(f"Modified {old_expression} to {self.expression} by adding {new_instruction} to previous index: {index}, similarity_score {score_change} from {old_score:.8f} to {new_score:.8f}")
+        self.track.append(TrackRecord('add_instruction', index, new_instruction, None, old_expression, self.expression, old_score, new_score))
     
         
     def remove_instruction(self, index):
@@ -97,15 +388,26 @@ class Function:
         if index < 1 or index >= len(self.instructions):
             raise IndexError("Instruction index out of range")
         removed_instruction = self.instructions.pop(index)
+        self._edited(index)
         self.update_expression()
         
         new_score = self.evaluate_similarity(self.calculate(self.x_values), self.desired_output)["similarity_score"]
-        score_change = "decreased" if new_score < old_score else "remained the same" if new_score == old_score else "increased"
-        self.track.append(f"Modified {old_expression} to {self.expression} by removing {removed_instruction} from previous index: {index}, similarity_score {score_change} from {old_score:.8f} to {new_score:.8f}")
+        self.track.append(TrackRecord('remove_instruction', index, None, removed_instruction, old_expression, self.expression, old_score, new_score))
     
     def add_track(self, score, result, instruction, expression, desired_output):
-        track = f"The x values are {self.x_values}; \\the y values are {result};\\ the desired_output is {desired_output};\\ the initial function instruction is {instruction};\\ and corresponding expression is {expression};\\ the similarity score is {score}"
-        self.track.append(track)
+        """
+        record the starting point of the history; the x and desired values live once in track.context
+        (the y values are recomputed from the current function whenever the track is rendered)
+        """
+        if self.track.context is None:
+            self.track.context = TrackContext(self.x_values, desired_output)
+        self.track.append(TrackRecord('initial', None, tuple(instruction), None, None, expression, float(score), float(score)))
+
+    def render_track(self, max_chars=4000):
+        """
+        the history as a prompt for llm_for_mutation, kept within roughly max_chars
+        """
+        return self.track.render(self, max_chars)
     
     def substitute_instruction(self, index, new_instruction):
         old_expression = self.expression
@@ -114,13 +416,14 @@ class Function:
         new_instruction = self.format_instruction(new_instruction)
         if index < 1 or index >= len(self.instructions):
             raise IndexError("Instruction index out of range or attempt to modify initial instruction")
+        step = compile_instruction(new_instruction)
         old_instruction = self.instructions[index]
         self.instructions[index] = new_instruction
+        self._edited(index, step)
         self.update_expression()
         
         new_score = self.evaluate_similarity(self.calculate(self.x_values), self.desired_output)["similarity_score"]
-        score_change = "decreased" if new_score < old_score else "remained the same" if new_score == old_score else "increased"
-        self.track.append(f"Modified {old_expression} to {self.expression} by changing {old_instruction} to {new_instruction} at the index: {index}, similarity_score {score_change} from {old_score:.8f} to {new_score:.8f}")
+        self.track.append(TrackRecord('substitute_instruction', index, new_instruction, old_instruction, old_expression, self.expression, old_score, new_score))
 
 
     def format_instruction(self, instruction):
@@ -165,8 +468,24 @@ class Function:
                 expression = f'({value} - {expression})'
         self.expression = expression
         
+OPERATIONS = ['add', 'subtract', 'multiply', 'divide', 'power', 'ln', 'sin', 'cos', 'log']
+
+
+def random_instruction(rng=random, operations=OPERATIONS):
+    """
+    one random single-operation instruction from the same vocabulary generate_random_equation uses
+    """
+    op = rng.choice(operations)
+    if op in ['add', 'subtract', 'multiply', 'divide']:
+        symbol = {'add': '+', 'subtract': '-', 'multiply': '*', 'divide': '/'}[op]
+        return f'y = y {symbol} {rng.randint(1, 10)}'
+    if op == 'power':
+        return f'y = y ^ {rng.randint(2, 4)}'
+    return f'y = {op}(y)'
+
+
 def generate_random_equation():
-    operations = ['add', 'subtract', 'multiply', 'divide', 'power', 'ln', 'sin', 'cos', 'log']
+    operations = OPERATIONS
     steps = random.randint(2, 5)
     instructions = ['y = x']
     expression = 'x'
@@ -222,23 +541,25 @@ desired_output = [
 ]
 
 
-results = []
-for i in range(len(time_value)):
-    row_function = generate_random_equation()
-    row_function_expression = row_function.expression
-    row_function_result = row_function.calculate(time_value[i][0])
-    row_function_similarity = row_function.evaluate_similarity(row_function_result, desired_output[i][0])
-    
-    col_function = generate_random_equation()
-    col_function_expression = col_function.expression
-    col_function_result = col_function.calculate(time_value[i][1])
-    col_function_similarity = col_function.evaluate_similarity(col_function_result, desired_output[i][1])
-    
-    results.append({
-        "row_function_result": row_function_result,
-        "row_function_expression": row_function_expression,
-        "row_function_similarity": row_function_similarity,
-        "col_function_result": col_function_result,
-        "col_function_expression": col_function_expression,
-        "col_function_similarity": col_function_similarity
-    })
+
+if __name__ == "__main__":
+    results = []
+    for i in range(len(time_value)):
+        row_function = generate_random_equation()
+        row_function_expression = row_function.expression
+        row_function_result = row_function.calculate(time_value[i][0])
+        row_function_similarity = row_function.evaluate_similarity(row_function_result, desired_output[i][0])
+
+        col_function = generate_random_equation()
+        col_function_expression = col_function.expression
+        col_function_result = col_function.calculate(time_value[i][1])
+        col_function_similarity = col_function.evaluate_similarity(col_function_result, desired_output[i][1])
+
+        results.append({
+            "row_function_result": row_function_result,
+            "row_function_expression": row_function_expression,
+            "row_function_similarity": row_function_similarity,
+            "col_function_result": col_function_result,
+            "col_function_expression": col_function_expression,
+            "col_function_similarity": col_function_similarity
+        })
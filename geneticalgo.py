@@ -1,93 +1,399 @@
-import random
-from function import Function, generate_random_equation
-import tabulate
-from callm import llm_for_mutation, llm_for_initial_generation
-import re
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+import numpy as np
+from function import Function, execute_programs, score_outputs, canonical_program, SCORE_COLUMNS
+from history import TrackContext
+from scoring import Scorer
+from checkpoint import save_checkpoint, load_checkpoint
+from instrument import logger, metrics
+from callm import llm_for_initial_generations, RequestCounter
+from mutation import LLMMutator, parse_mutation
 
 class GeneticAlgorithm:
-    def __init__(self, time_value, desired_output, population_size, generations):
+    def __init__(self, time_value, desired_output, population_size, generations, llm=None, fit_constants=False, mutator=None,
+                 fitness_cache_size=4096, reject_duplicates=False, duplicate_attempts=5,
+                 checkpoint_path=None, checkpoint_every=1, initial_population=None, target_score=None, patience=None,
+                 time_budget=None, llm_budget=None, adaptive_mutations=False, scorer=None, mask=None):
         self.time_value = time_value
         self.desired_output = desired_output
         self.population_size = population_size
         self.generations = generations
         self.population = []
+        self.generation_scores = []
+        self.track_context = TrackContext(time_value, desired_output)  # shared by every candidate's history
+        self.llm = llm  # optional callm.AsyncLLM; when set, run() issues its LLM requests concurrently
+        self.fit_constants = fit_constants  # refit every candidate's numeric literals before it is scored
+        self.mutator = mutator if mutator is not None else LLMMutator()  # a mutation.MutationStrategy
+        self.generation = 0
+        self.next_generation = 0  # raise generations and call run() again to continue where the last run stopped
+        self.fitness_cache = OrderedDict()  # canonical program -> score dict, least recently used first
+        self.fitness_cache_size = fitness_cache_size
+        self.fitness_cache_hits = 0
+        self.fitness_cache_misses = 0
+        self.reject_duplicates = reject_duplicates  # keep every population slot a distinct program
+        self.duplicate_attempts = duplicate_attempts
+        self.checkpoint_path = checkpoint_path  # save the run here every checkpoint_every generations and resume from it
+        self.checkpoint_every = checkpoint_every
+        self.target_score = target_score  # stop once the best similarity_score reaches this
+        self.patience = patience  # stop after this many generations without a better best score
+        self.time_budget = time_budget  # seconds of wall-clock time before no new generation is started
+        # LLM requests actually sent (cache hits excluded) before the run stops; the initial population asks
+        # for at most this many candidates, so a budget below population_size also shrinks the population
+        self.llm_budget = llm_budget
+        self.adaptive_mutations = adaptive_mutations  # spend more mutations on lineages that are improving
+        # scoring.Scorer for selection, restricted to the frames where mask is True (e.g. real detections only)
+        if mask is not None:
+            scorer = (scorer if scorer is not None else Scorer()).masked(mask)
+        self.scorer = scorer
+        self.llm_requests = RequestCounter()
+        self.best_score = float('-inf')
+        self.stale_generations = 0
+        self.started = None  # perf_counter() at the start of the run, less the time of any run it resumes
+        self.stop_reason = None
+        if initial_population is not None:  # warm start from earlier candidates instead of asking the LLM
+            self.seed_population(initial_population)
 
-    def extract_index(self,input_string):
+    @property
+    def llm_calls(self):
+        return self.llm_requests.count
+
+    def desired_output_text(self):
+        # desired_output may be a list or a NumPy view; either way the prompt gets a plain, untruncated list
+        return str(np.asarray(self.desired_output, dtype=float).tolist())
+
+    def program_key(self, func):
+        return canonical_program(func.compile())
+
+    def evaluate_population(self, population):
         """
-        This function extracts the content between '(' and ',' in the input string.
-        
-        :param input_string: The string to be processed.
-        :return: The extracted content.
+        score the whole population, looking each canonical program up in the fitness cache first and
+        running every program not seen before in one batched pass over the shared time_value vector.
+
+        :param population: The list of Function candidates to score.
+        :return: One score dict per candidate.
         """
-        pattern = r'\(([^,]+),'
-        match = re.search(pattern, input_string)
-        if match:
-            return float(match.group(1))
-        else:
-            return None
-        
-    def mutate(self, function): # call_chatgpt, 
-        print("\nMutation:\n")
-        order = "function." + llm_for_mutation(str(function.track))
-        order = order.replace('x', 'y')
-        index = self.extract_index(order)
-        def deal_with_index(function, order, index, max_attempts=100, attempt=0):
-            if attempt >= max_attempts:
-                return None
-            
-            if 'add_instruction' in order:
-                if 0 < index <= len(function.instructions):
-                    return order
-            else:
-                if 0 < index < len(function.instructions):
-                    return order
-            
-            new_order = "function." + llm_for_mutation(str(function.track))
-            new_order = new_order.replace('x', 'y')
-            new_index = self.extract_index(new_order)
-            
-            return deal_with_index(function, new_order, new_index, max_attempts, attempt + 1)
-
-        order = deal_with_index(function, order, index)
-        if order is None:
-            print("Failed to generate a valid order.")
-        
-        print("\norder: " )
-        print(order)
-        exec(order)
-        function.update_expression()
-        print(function.instructions)
-        print(function.track)
+        keys = [self.program_key(func) for func in population]
+        missing = list(dict.fromkeys(key for key in keys if key not in self.fitness_cache))
+        self.fitness_cache_hits += len(keys) - len(missing)
+        self.fitness_cache_misses += len(missing)
+        metrics.count("fitness_cache_hits", len(keys) - len(missing))
+        metrics.count("candidate_evaluations", len(missing))
+        if missing:
+            with metrics.timer("candidate_evaluation"):
+                outputs = execute_programs(list(missing), self.time_value)
+                if self.scorer is not None:
+                    columns, matrix = self.scorer.columns, self.scorer(outputs, self.desired_output)
+                else:
+                    columns, matrix = SCORE_COLUMNS, score_outputs(outputs, self.desired_output)
+                for key, row in zip(missing, matrix.tolist()):
+                    self.fitness_cache[key] = dict(zip(columns, row))
+        scores = []
+        for func, key in zip(population, keys):
+            self.fitness_cache.move_to_end(key)
+            score = dict(self.fitness_cache[key])
+            func.x_values = self.time_value
+            func.desired_output = self.desired_output
+            func.scorer = self.scorer
+            func.score = score["similarity_score"]
+            scores.append(score)
+        while len(self.fitness_cache) > self.fitness_cache_size:
+            self.fitness_cache.popitem(last=False)
+        return scores
 
-    def run(self):
-        population = [llm_for_initial_generation(str(self.desired_output)) for _ in range(self.population_size)]
-        for instruction in population:
+    def apply_mutation(self, function, mutation):
+        mutation.apply(function)
+        metrics.count("mutations_applied")
+        logger.debug("Mutation: %s -> %s\n%s", mutation, function.instructions, function.track[-1])
+
+    def mutate(self, function, max_attempts=100): # call_chatgpt, 
+        for attempt in range(max_attempts):
+            if self.mutator.uses_llm(self, attempt):
+                if self.llm_budget is not None and self.llm_calls >= self.llm_budget:
+                    metrics.count("mutations_over_budget")
+                    return
+            mutation = parse_mutation(self.mutator.propose(self, function, attempt))
+            if mutation is not None and mutation.is_valid_for(function):
+                self.apply_mutation(function, mutation)
+                return
+            metrics.count("mutations_rejected")
+        logger.warning("Failed to generate a valid order.")
+
+    async def mutate_async(self, function, max_attempts=100):
+        for attempt in range(max_attempts):
+            if self.mutator.uses_llm(self, attempt):
+                if self.llm_budget is not None and self.llm_calls >= self.llm_budget:
+                    metrics.count("mutations_over_budget")
+                    return
+            mutation = parse_mutation(await self.mutator.propose_async(self, function, attempt))
+            if mutation is not None and mutation.is_valid_for(function):
+                self.apply_mutation(function, mutation)
+                return
+            metrics.count("mutations_rejected")
+        logger.warning("Failed to generate a valid order.")
+
+    def initial_candidates(self):
+        """
+        how many initial candidates to ask the LLM for: population_size, capped at the remaining llm_budget
+        since each may cost a request
+        """
+        if self.llm_budget is None:
+            return self.population_size
+        count = min(self.population_size, self.llm_budget - self.llm_calls)
+        if count < 1:
+            raise ValueError("llm_budget leaves no LLM request for the initial population; pass initial_population")
+        if count < self.population_size:
+            logger.warning("llm_budget of %d allows only %d of %d initial candidates", self.llm_budget, count,
+                           self.population_size)
+        return count
+
+    def initialize_population(self, replies):
+        seen = set()
+        for instruction in replies:
             func = Function.create_from_instructions(instruction)
+            func.track.context = self.track_context
+            if self.reject_duplicates:
+                key = self.program_key(func)
+                if key in seen:
+                    continue
+                seen.add(key)
             self.population.append(func)
-        for generation in range(self.generations):
-            print(f'\nGeneration {generation}')
-            scores = []
+
+    def seed_population(self, functions):
+        """
+        start from copies of existing candidates, keeping their histories, e.g. the survivors of a fit on an
+        earlier window of the same trajectory
+        """
+        for func in functions:
+            func = func.copy()
+            func.track.context = self.track_context
+            self.population.append(func)
+
+    def breed_unique(self, best_functions):
+        """
+        two mutated copies of every survivor, retrying a mutation up to duplicate_attempts times while it
+        produces a program already in the new population; a slot is left empty if every attempt collides
+        """
+        new_population = list(best_functions)
+        seen = {self.program_key(func) for func in new_population}
+        for parent, count in zip(best_functions, self.mutation_counts(best_functions)):
+            for _ in range(count):
+                for _ in range(self.duplicate_attempts):
+                    child = parent.copy()
+                    self.mutate(child)
+                    key = self.program_key(child)
+                    if key not in seen:
+                        seen.add(key)
+                        new_population.append(child)
+                        break
+        return new_population
+
+    async def breed_unique_async(self, best_functions):
+        new_population = list(best_functions)
+        seen = {self.program_key(func) for func in new_population}
+
+        async def breed(parent, count):
+            for _ in range(count):
+                for _ in range(self.duplicate_attempts):
+                    child = parent.copy()
+                    await self.mutate_async(child)
+                    key = self.program_key(child)
+                    if key not in seen:
+                        seen.add(key)
+                        new_population.append(child)
+                        break
+
+        await asyncio.gather(*(breed(parent, count)
+                               for parent, count in zip(best_functions, self.mutation_counts(best_functions))))
+        return new_population
+
+    def fit_population(self):
+        if self.fit_constants:
             for func in self.population:
-                result = func.calculate(self.time_value)
-                score = func.evaluate_similarity(result, self.desired_output)     
-                scores.append((score, func))
-                if generation == 0:
-                    func.add_track(str(score['similarity_score']), result, func.instructions, func.expression, self.desired_output)
-        
-            print("\nScores: ", [(score, func.expression) for score, func in scores])
-            scores.sort(reverse=True, key=lambda x: x[0]["similarity_score"])
-            best_functions = [func for _, func in scores[:self.population_size // 2]] 
-            print(f"\nBest functions: {[func.expression for func in best_functions]}\n")
-            temp_population = best_functions.copy()
-            new_population = best_functions.copy()
-            for new_func in temp_population:
-                temp_func = new_func
-                self.mutate(new_func)
-                new_population.append(new_func)
-                self.mutate(temp_func)
-                new_population.append(temp_func)
-            self.population = new_population
-        best_function = max(self.population, key=lambda func:
-            func.evaluate_similarity(func.calculate(self.time_value), self.desired_output)['similarity_score'])
-        return best_function
+                func.scorer = self.scorer  # fit on the scorer's mask and keep a fit only if its score does not drop
+                func.fit_constants(self.time_value, self.desired_output)
+
+    def check_convergence(self):
+        """
+        :return: why the run should stop instead of breeding another generation, or None to carry on
+        """
+        best_score = max(score["similarity_score"] for score in self.generation_scores[-1])
+        if best_score > self.best_score:
+            self.best_score = best_score
+            self.stale_generations = 0
+        else:
+            self.stale_generations += 1
+        if self.target_score is not None and best_score >= self.target_score:
+            return f"reached the target score {self.target_score}"
+        if self.patience is not None and self.stale_generations >= self.patience:
+            return f"no improvement in {self.stale_generations} generations"
+        if self.time_budget is not None and time.perf_counter() - self.started >= self.time_budget:
+            return f"used the {self.time_budget}s time budget"
+        if self.llm_budget is not None and self.llm_calls >= self.llm_budget:
+            return f"used the budget of {self.llm_budget} LLM calls"
+        return None
+
+    @staticmethod
+    def improving(func):
+        """
+        :return: whether the last mutation of func's lineage raised its score, or None before its first mutation
+        """
+        if not func.track or func.track[-1].op == 'initial':
+            return None
+        return func.track[-1].new_score > func.track[-1].old_score
+
+    def mutation_counts(self, best_functions):
+        """
+        how many mutations each survivor gets: two, or with adaptive_mutations three for a lineage whose last
+        mutation improved it and one for a lineage whose last mutation did not
+        """
+        if not self.adaptive_mutations:
+            return [2] * len(best_functions)
+        counts = {True: 3, False: 1, None: 2}
+        return [counts[self.improving(func)] for func in best_functions]
+
+    def select(self, generation):
+        logger.info("Generation %d", generation)
+        self.generation = generation
+        self.fit_population()
+        population_scores = self.evaluate_population(self.population)
+        self.generation_scores.append(population_scores)
+        scores = list(zip(population_scores, self.population))
+        if generation == 0:
+            for score, func in scores:
+                func.add_track(str(score['similarity_score']), None, func.instructions, func.expression, self.desired_output)
     
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Scores: %s", [(score, func.expression) for score, func in scores])
+        scores.sort(reverse=True, key=lambda x: x[0]["similarity_score"])
+        best_functions = [func for _, func in scores[:self.population_size // 2]] 
+        logger.info("Best functions: %s", [func.expression for func in best_functions])
+        return best_functions
+
+    def best(self):
+        if self.fit_constants:
+            self.fit_population()
+            self.evaluate_population(self.population)
+        elif not self.generation_scores:
+            self.evaluate_population(self.population)
+        # func.score is kept current by evaluate_population and by every mutation operator
+        best_function = max(self.population, key=lambda func: func.score)
+        return best_function
+
+    def stop_early(self, generation):
+        self.stop_reason = self.check_convergence()
+        if self.stop_reason is None:
+            return False
+        logger.info("Stopping after generation %d: %s", generation, self.stop_reason)
+        metrics.count("early_stops")
+        self.save_checkpoint(self.generations)  # a resumed run goes straight to the result
+        return True
+
+    def save_checkpoint(self, next_generation):
+        if not self.checkpoint_path:
+            return
+        if next_generation % self.checkpoint_every and next_generation != self.generations:
+            return
+        save_checkpoint(self.checkpoint_path, {
+            "next_generation": next_generation,
+            "population": self.population,
+            "generation_scores": self.generation_scores,
+            "llm_calls": self.llm_calls,
+            "best_score": self.best_score,
+            "stale_generations": self.stale_generations,
+            "elapsed": time.perf_counter() - self.started,
+        })
+
+    def restore_checkpoint(self):
+        """
+        :return: the generation to continue from, or None when there is no checkpoint to resume
+        """
+        state = load_checkpoint(self.checkpoint_path)
+        if state is None:
+            return None
+        self.population = state["population"]
+        self.generation_scores = state["generation_scores"]
+        for func in self.population:
+            func.track.context = self.track_context
+        # early stopping carries on from where the saved run left off
+        self.llm_requests.count = state.get("llm_calls", 0)
+        self.best_score = state.get("best_score", float('-inf'))
+        self.stale_generations = state.get("stale_generations", 0)
+        self.started = time.perf_counter() - state.get("elapsed", 0.0)
+        logger.info("Resuming from generation %d", state["next_generation"])
+        self.next_generation = state["next_generation"]
+        return self.next_generation
+
+    def breed(self, best_functions):
+        new_population = best_functions.copy()
+        for func, count in zip(best_functions, self.mutation_counts(best_functions)):
+            for _ in range(count):
+                self.mutate(func)
+                new_population.append(func)
+        return new_population
+
+    async def breed_async(self, best_functions):
+        new_population = best_functions.copy()
+        counts = self.mutation_counts(best_functions)
+        for step in range(max(counts, default=0)):
+            await asyncio.gather(*(self.mutate_async(func) for func, count in zip(best_functions, counts) if count > step))
+        for func, count in zip(best_functions, counts):
+            new_population.extend([func] * count)
+        return new_population
+
+    def run(self):
+        if self.llm is not None:
+            return asyncio.run(self.run_async())
+        with self.llm_requests.active():
+            return self._run()
+
+    def _run(self):
+        if self.started is None:
+            self.started = time.perf_counter()
+        start = self.restore_checkpoint()
+        if start is None:
+            if not self.population:
+                self.initialize_population(llm_for_initial_generations(self.desired_output_text(), self.initial_candidates()))
+            start = self.next_generation
+        for generation in range(start, self.generations):
+            with metrics.timer("generation"):
+                best_functions = self.select(generation)
+                if self.stop_early(generation):
+                    break
+                if self.reject_duplicates:
+                    self.population = self.breed_unique(best_functions)
+                else:
+                    self.population = self.breed(best_functions)
+            self.next_generation = generation + 1
+            self.save_checkpoint(generation + 1)
+        return self.best()
+
+    async def run_async(self):
+        """
+        same loop as run, but every mutation of a round is requested concurrently through self.llm.
+        Each survivor's mutations still run in sequence, so every request sees the previous mutation's record.
+        """
+        with self.llm_requests.active():
+            return await self._run_async()
+
+    async def _run_async(self):
+        if self.started is None:
+            self.started = time.perf_counter()
+        start = self.restore_checkpoint()
+        if start is None:
+            if not self.population:
+                self.initialize_population(await self.llm.initial_generations(self.desired_output_text(), self.initial_candidates()))
+            start = self.next_generation
+        for generation in range(start, self.generations):
+            with metrics.timer("generation"):
+                best_functions = self.select(generation)
+                if self.stop_early(generation):
+                    break
+                if self.reject_duplicates:
+                    self.population = await self.breed_unique_async(best_functions)
+                else:
+                    self.population = await self.breed_async(best_functions)
+            self.next_generation = generation + 1
+            self.save_checkpoint(generation + 1)
+        return self.best()
@@ -0,0 +1,94 @@
+from collections import deque, namedtuple
+import numpy as np
+
+
+class TrackContext:
+    """
+    the x values and desired_output of one GA run, stored once and shared by every candidate's history
+    """
+    def __init__(self, x_values, desired_output):
+        self.x_values = np.asarray(x_values, dtype=float)
+        self.desired_output = np.asarray(desired_output, dtype=float)
+
+
+class TrackRecord(namedtuple('TrackRecord', ['op', 'index', 'instruction', 'old_instruction',
+                                             'old_expression', 'expression', 'old_score', 'new_score'])):
+    """
+    one compact history entry. op is 'initial', 'fit_constants' or one of the mutation operations.
+    """
+    def score_change(self):
+        if self.new_score < self.old_score:
+            return "decreased"
+        return "remained the same" if self.new_score == self.old_score else "increased"
+
+    def compact(self):
+        """
+        one short line for the LLM prompt
+        """
+        if self.op == 'initial':
+            return f"initial {list(self.instruction)}: score {self.new_score:.6g}"
+        if self.op == 'fit_constants':
+            action = f"fit constants -> {self.expression}"
+        elif self.op == 'remove_instruction':
+            action = f"remove_instruction({self.index}) [{self.old_instruction}]"
+        elif self.op == 'substitute_instruction':
+            action = f"substitute_instruction({self.index}, {self.instruction!r}) [was {self.old_instruction}]"
+        else:
+            action = f"{self.op}({self.index}, {self.instruction!r})"
+        return f"{action}: score {self.old_score:.6g} -> {self.new_score:.6g} ({self.new_score - self.old_score:+.3g})"
+
+    def __str__(self):
+        if self.op == 'initial':
+            return f"The initial function instruction is {list(self.instruction)}; and corresponding expression is {self.expression}; the similarity score is {self.new_score}"
+        change = f"similarity_score {self.score_change()} from {self.old_score:.8f} to {self.new_score:.8f}"
+        if self.op == 'fit_constants':
+            return f"Fitted the constants of {self.old_expression} to get {self.expression}, {change}"
+        if self.op == 'add_instruction':
+            action = f"adding {self.instruction} to previous index: {self.index}"
+        elif self.op == 'remove_instruction':
+            action = f"removing {self.old_instruction} from previous index: {self.index}"
+        else:
+            action = f"changing {self.old_instruction} to {self.instruction} at the index: {self.index}"
+        return f"Modified {self.old_expression} to {self.expression} by {action}, {change}"
+
+
+def _sample(values, max_points):
+    values = np.asarray(values, dtype=float)
+    if len(values) > max_points:
+        values = values[np.linspace(0, len(values) - 1, max_points).round().astype(int)]
+    return "[" + ", ".join(f"{value:.4g}" for value in values) + "]"
+
+
+class MutationHistory(deque):
+    """
+    bounded ring buffer of TrackRecords; the oldest records drop off once maxlen is reached
+    """
+    def __init__(self, records=(), maxlen=50, context=None):
+        super().__init__(records, maxlen)
+        self.context = context
+
+    def render(self, function, max_chars=4000, max_points=24):
+        """
+        summarise the run for the mutation prompt within roughly max_chars (about max_chars / 4 tokens):
+        the data and the current function's output at up to max_points evenly spaced points, the current
+        instructions and score, then as many of the most recent records as fit.
+        """
+        lines = []
+        if self.context is not None:
+            x_values = self.context.x_values
+            lines.append(f"Data: {len(x_values)} points, x from {x_values[0]:.4g} to {x_values[-1]:.4g}" if len(x_values) else "Data: 0 points")
+            lines.append(f"x values: {_sample(x_values, max_points)}")
+            lines.append(f"desired_output: {_sample(self.context.desired_output, max_points)}")
+            lines.append(f"current y values: {_sample(function.calculate(x_values), max_points)}")
+        lines.append(f"Current function: {function.instructions} i.e. y = {function.expression}, similarity_score {function.score:.8g}")
+        used = sum(len(line) + 1 for line in lines)
+        shown = []
+        for record in reversed(self):
+            line = record.compact()
+            if used + len(line) + 1 > max_chars:
+                break
+            shown.append(line)
+            used += len(line) + 1
+        lines.append(f"Mutation history (oldest first, {len(shown)} of {len(self)} kept records shown):")
+        lines.extend(reversed(shown))
+        return "\n".join(lines)
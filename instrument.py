@@ -0,0 +1,136 @@
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("smartga")
+
+
+class Metrics:
+    """
+    process-wide counters and stage timers. count(name) adds to a counter; timer(name) records how many times
+    a stage ran, its total and its slowest duration. Safe to update from worker threads.
+    """
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds, count=1, longest=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            previous_count, total, previous_longest = self.timers.get(name, (0, 0.0, 0.0))
+            longest = seconds if longest is None else longest
+            self.timers[name] = (previous_count + count, total + seconds, max(previous_longest, longest))
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def _snapshot(self):
+        return {
+            "counters": dict(self.counters),
+            "timers": {name: {"count": count, "total_seconds": total, "max_seconds": longest}
+                       for name, (count, total, longest) in self.timers.items()},
+        }
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot()
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def drain(self):
+        """
+        snapshot and reset in one step, for shipping a worker process's metrics back to the parent
+        """
+        with self._lock:
+            snapshot = self._snapshot()
+            self.counters.clear()
+            self.timers.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+        for name, value in snapshot["counters"].items():
+            self.count(name, value)
+        for name, timer in snapshot["timers"].items():
+            self.observe(name, timer["total_seconds"], timer["count"], timer["max_seconds"])
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent, sort_keys=True)
+
+    def to_prometheus(self, prefix="smartga"):
+        """
+        the Prometheus text exposition format: counters as <name>_total, timers as a
+        <name>_seconds summary (count and sum) plus a <name>_seconds_max gauge
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = f"{prefix}_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, timer in sorted(snapshot["timers"].items()):
+            metric = f"{prefix}_{_metric_name(name)}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f"{metric}_count {timer['count']}")
+            lines.append(f"{metric}_sum {timer['total_seconds']:.9g}")
+            lines.append(f"# TYPE {metric}_max gauge")
+            lines.append(f"{metric}_max {timer['max_seconds']:.9g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        write to path as JSON when it ends in .json, Prometheus text otherwise
+        """
+        text = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        with open(path, "w") as file:
+            file.write(text)
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+metrics = Metrics()
+
+
+def reset_metrics():
+    """
+    process pool initializer: a forked worker starts with a copy of the parent's metrics, which must not be sent back
+    """
+    metrics.reset()
+
+
+def configure_logging(level=logging.INFO):
+    """
+    send the pipeline's progress messages to stderr at level (logging.DEBUG also shows every score and mutation);
+    level=None turns them off
+    """
+    if level is None:
+        logger.disabled = True
+        return
+    logger.disabled = False
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
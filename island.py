@@ -0,0 +1,151 @@
+import multiprocessing
+import queue
+import random
+import traceback
+from geneticalgo import GeneticAlgorithm
+from instrument import logger, metrics, reset_metrics
+
+
+def emigrants(ga, count):
+    """
+    copies of the count best distinct programs in ga's population
+    """
+    chosen = {}
+    for func in sorted(ga.population, key=lambda func: func.score, reverse=True):
+        chosen.setdefault(ga.program_key(func), func)
+        if len(chosen) == count:
+            break
+    migrants = [func.copy() for func in chosen.values()]
+    for func in migrants:
+        func.track.context = None  # the receiving island has its own
+    return migrants
+
+
+def immigrate(ga, arrivals):
+    """
+    replace the worst members of ga's population with the arriving candidates
+    """
+    if not arrivals:
+        return
+    ga.population.sort(key=lambda func: func.score, reverse=True)
+    del ga.population[max(len(ga.population) - len(arrivals), 0):]
+    for func in arrivals:
+        func.track.context = ga.track_context
+        ga.population.append(func)
+    metrics.count("island_immigrants", len(arrivals))
+
+
+def run_island(index, time_value, desired_output, ga_options, llm_factory, epochs, generations_per_epoch, migrants,
+               inbox, neighbour, results, seed):
+    """
+    worker process for one island: evolve generations_per_epoch generations, send copies of the best migrants
+    to the neighbouring island, take in whatever migrants have arrived, and repeat for epochs epochs
+    """
+    reset_metrics()
+    try:
+        if seed is not None:
+            random.seed(seed)
+        llm = llm_factory() if llm_factory is not None else None
+        ga = GeneticAlgorithm(time_value, desired_output, generations=0, llm=llm, **ga_options)
+        for epoch in range(epochs):
+            ga.generations += generations_per_epoch
+            ga.run()
+            if ga.stop_reason is not None:
+                break
+            if migrants:
+                neighbour.put(emigrants(ga, migrants))
+            arrivals = []
+            while True:
+                try:
+                    arrivals.extend(inbox.get_nowait())
+                except queue.Empty:
+                    break
+            immigrate(ga, arrivals)
+        best = ga.best()
+        results.put((index, best, {
+            "best_score": best.score,
+            "generations": ga.next_generation,
+            "llm_calls": ga.llm_calls,
+            "stop_reason": ga.stop_reason,
+            "metrics": metrics.drain(),
+        }))
+    except Exception:
+        results.put((index, None, {"error": traceback.format_exc()}))
+
+
+class IslandModel:
+    """
+    island-model GA: islands independent GeneticAlgorithm populations, each in its own worker process, evolve
+    the same trajectory. After every epoch of generations_per_epoch generations each island sends copies of
+    its migrants best distinct candidates to the next island in a ring through a local queue (served by a
+    multiprocessing manager, so an island may exit with migrants still undelivered), and replaces its worst
+    candidates with whatever migrants have reached it. Migration never blocks, so a slow or early-stopped island
+    does not hold the others up.
+
+    ga_options apply to every island and island_options (a list with one dict per island) override them per
+    island, e.g. a different mutator for each:
+        IslandModel(x, y, islands=3, population_size=10, island_options=[
+            {"mutator": LLMMutator()}, {"mutator": MixedMutator(llm_every=3)}, {"mutator": LocalMutator(seed=2)}])
+    Everything in the options must be picklable; llm_factory (see scheduler.FitScheduler) builds each island's
+    AsyncLLM inside its process.
+    """
+    def __init__(self, time_value, desired_output, islands=4, epochs=5, generations_per_epoch=2, migrants=2,
+                 island_options=None, llm_factory=None, seed=None, **ga_options):
+        if island_options is not None and len(island_options) != islands:
+            raise ValueError("island_options needs one dict per island")
+        self.time_value = time_value
+        self.desired_output = desired_output
+        self.islands = islands
+        self.epochs = epochs
+        self.generations_per_epoch = generations_per_epoch
+        self.migrants = migrants
+        self.island_options = island_options if island_options is not None else [{} for _ in range(islands)]
+        self.llm_factory = llm_factory
+        self.seed = seed
+        self.ga_options = ga_options
+        self.island_results = []
+
+    def run(self):
+        """
+        :return: the best Function found by any island; per-island statistics are left in island_results
+        """
+        context = multiprocessing.get_context()
+        with context.Manager() as manager:
+            return self._run(context, [manager.Queue() for _ in range(self.islands)])
+
+    def _run(self, context, inboxes):
+        results = context.Queue()
+        processes = []
+        for index in range(self.islands):
+            options = dict(self.ga_options, **self.island_options[index])
+            seed = None if self.seed is None else self.seed + index
+            process = context.Process(target=run_island, daemon=True, args=(
+                index, self.time_value, self.desired_output, options, self.llm_factory, self.epochs,
+                self.generations_per_epoch, self.migrants, inboxes[index], inboxes[(index + 1) % self.islands],
+                results, seed))
+            process.start()
+            processes.append(process)
+        finished = {}
+        try:
+            while len(finished) < self.islands:
+                try:
+                    index, best, stats = results.get(timeout=1.0)
+                except queue.Empty:
+                    # a worker that exits cleanly has already queued its result; only a crash loses it
+                    if any(process.exitcode not in (None, 0) for process in processes):
+                        raise RuntimeError("An island process exited without a result")
+                    continue
+                if best is None:
+                    raise RuntimeError(f"Island {index} failed:\n{stats['error']}")
+                metrics.merge(stats.pop("metrics"))
+                finished[index] = (best, stats)
+                logger.info("Island %d finished: score %s after %d generations", index, stats["best_score"],
+                            stats["generations"])
+        finally:
+            for process in processes:
+                if process.is_alive() and len(finished) < self.islands:
+                    process.terminate()
+                process.join()
+        self.island_results = [dict(finished[index][1], island=index, best_function=finished[index][0])
+                               for index in range(self.islands)]
+        return max((best for best, _ in finished.values()), key=lambda func: func.score)
@@ -0,0 +1,213 @@
+import ast
+import json
+import random
+import re
+from collections import namedtuple
+from function import random_instruction, compile_instruction
+from callm import llm_for_mutation
+
+MUTATION_OPERATIONS = ('add_instruction', 'remove_instruction', 'substitute_instruction')
+_CALL_START = re.compile(r'\b(?:function\.)?(?:add_instruction|remove_instruction|substitute_instruction)\s*\(')
+_CODE_BLOCK = re.compile(r'```[\w+-]*[ \t]*\n?(.*?)```', re.DOTALL)
+
+
+class Mutation(namedtuple('Mutation', ['operation', 'index', 'instruction'])):
+    """
+    one typed mutation: operation is one of MUTATION_OPERATIONS, instruction is None for remove_instruction
+    """
+    def is_valid_for(self, function):
+        length = len(function.instructions)
+        if self.operation == 'add_instruction':
+            if not 0 < self.index <= length:
+                return False
+        elif not 0 < self.index < length:
+            return False
+        if self.instruction is None:
+            return self.operation == 'remove_instruction'
+        try:
+            compile_instruction(function.format_instruction(self.instruction))
+        except ValueError:
+            return False
+        return True
+
+    def apply(self, function):
+        if self.operation == 'remove_instruction':
+            function.remove_instruction(self.index)
+        else:
+            getattr(function, self.operation)(self.index, self.instruction)
+
+    def __str__(self):
+        if self.instruction is None:
+            return f"{self.operation}({self.index})"
+        return f"{self.operation}({self.index}, {self.instruction!r})"
+
+
+def _mutation_from_parts(operation, args):
+    if operation not in MUTATION_OPERATIONS:
+        return None
+    expected = 1 if operation == 'remove_instruction' else 2
+    if len(args) != expected:
+        return None
+    index = args[0]
+    if isinstance(index, float) and index.is_integer():
+        index = int(index)
+    if not isinstance(index, int) or isinstance(index, bool):
+        return None
+    instruction = None
+    if expected == 2:
+        if not isinstance(args[1], str):
+            return None
+        # instructions may only refer to y; the LLM often writes x for the running value
+        instruction = args[1].replace('x', 'y')
+    return Mutation(operation, index, instruction)
+
+
+def _parse_call(text):
+    try:
+        node = ast.parse(text.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+    if not isinstance(node, ast.Call) or node.keywords:
+        return None
+    func = node.func
+    name = func.attr if isinstance(func, ast.Attribute) else func.id if isinstance(func, ast.Name) else None
+    try:
+        args = [ast.literal_eval(arg) for arg in node.args]
+    except ValueError:
+        return None
+    return _mutation_from_parts(name, args)
+
+
+def _find_call(text):
+    """
+    the first mutation call inside prose: from each operation name, the shortest slice ending in ')' that
+    parses as a call, so instructions like 'y = cos(y)' keep their parentheses
+    """
+    for start in _CALL_START.finditer(text):
+        end = start.end()
+        while True:
+            end = text.find(')', end)
+            if end < 0:
+                break
+            end += 1
+            mutation = _parse_call(text[start.start():end])
+            if mutation is not None:
+                return mutation
+    return None
+
+
+def parse_mutation(reply):
+    """
+    turn an LLM reply into a Mutation without executing it, or None if it is not a valid mutation.
+    Accepts a call such as "add_instruction(2, 'y = y + 3')" (optionally prefixed with 'function.',
+    wrapped in a code block with or without a language tag, or inside a sentence), a JSON object
+    {"operation": ..., "index": ..., "instruction": ...}, or a Mutation, which is returned unchanged.
+    """
+    if isinstance(reply, Mutation):
+        return reply
+    if not isinstance(reply, str):
+        return None
+    block = _CODE_BLOCK.search(reply)
+    text = (block.group(1) if block else reply).strip().strip('`').strip()
+    if text.startswith('{'):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        args = [data.get('index')] + ([data['instruction']] if data.get('instruction') is not None else [])
+        return _mutation_from_parts(data.get('operation'), args)
+    mutation = _parse_call(text)
+    if mutation is None:
+        mutation = _find_call(text)
+    return mutation
+
+
+class MutationStrategy:
+    """
+    decides where the next mutation comes from. propose() returns an LLM-style reply such as
+    "add_instruction(2, 'y = y + 3')" or a Mutation; the GA parses and validates it and calls
+    propose() again with the next attempt number if it cannot be applied.
+    """
+    def propose(self, ga, function, attempt):
+        raise NotImplementedError
+
+    async def propose_async(self, ga, function, attempt):
+        return self.propose(ga, function, attempt)
+
+    def uses_llm(self, ga, attempt):
+        """
+        whether this attempt's proposal may cost an LLM request, so the GA checks its LLM budget before asking
+        """
+        return False
+
+
+class LLMMutator(MutationStrategy):
+    """
+    ask the LLM for every mutation (ga.llm when the GA runs asynchronously)
+    """
+    def propose(self, ga, function, attempt):
+        return llm_for_mutation(function.render_track())
+
+    async def propose_async(self, ga, function, attempt):
+        return await ga.llm.mutation(function.render_track())
+
+    def uses_llm(self, ga, attempt):
+        return True
+
+
+class LocalMutator(MutationStrategy):
+    """
+    random mutation from the generate_random_equation vocabulary, with no network round trip.
+    Edits are biased towards the tail of the program, where most useful mutations land.
+    """
+    def __init__(self, seed=None, operations=None, weights=(0.4, 0.2, 0.4)):
+        self.seed = seed  # kept so checkpoint.job_fingerprint can tell differently seeded mutators apart
+        self.random = random.Random(seed)
+        self.operations = operations
+        self.weights = weights  # add, remove, substitute
+
+    def _index(self, upper):
+        # pick from 1..upper, weighted towards upper
+        return max(self.random.randint(1, upper), self.random.randint(1, upper))
+
+    def propose(self, ga, function, attempt):
+        length = len(function.instructions)
+        choices = ['add', 'remove', 'substitute'] if length > 1 else ['add']
+        weights = self.weights[:len(choices)] if length > 1 else [1]
+        operation = self.random.choices(choices, weights=weights)[0]
+        if operation == 'remove':
+            return Mutation('remove_instruction', self._index(length - 1), None)
+        instruction = random_instruction(self.random, self.operations) if self.operations else random_instruction(self.random)
+        if operation == 'add':
+            return Mutation('add_instruction', self._index(length), instruction)
+        return Mutation('substitute_instruction', self._index(length - 1), instruction)
+
+
+class MixedMutator(MutationStrategy):
+    """
+    LLM mutations with a local fallback: the LLM is asked only every llm_every generations and
+    gets llm_attempts tries per mutation; every other proposal comes from the local mutator.
+    """
+    def __init__(self, llm=None, local=None, llm_every=1, llm_attempts=1):
+        self.llm = llm if llm is not None else LLMMutator()
+        self.local = local if local is not None else LocalMutator()
+        self.llm_every = llm_every
+        self.llm_attempts = llm_attempts
+
+    def _use_llm(self, ga, attempt):
+        return ga.generation % self.llm_every == 0 and attempt < self.llm_attempts
+
+    def uses_llm(self, ga, attempt):
+        return self.llm.uses_llm(ga, attempt) if self._use_llm(ga, attempt) else self.local.uses_llm(ga, attempt)
+
+    def propose(self, ga, function, attempt):
+        if self._use_llm(ga, attempt):
+            return self.llm.propose(ga, function, attempt)
+        return self.local.propose(ga, function, attempt)
+
+    async def propose_async(self, ga, function, attempt):
+        if self._use_llm(ga, attempt):
+            return await self.llm.propose_async(ga, function, attempt)
+        return await self.local.propose_async(ga, function, attempt)
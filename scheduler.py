@@ -0,0 +1,156 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from geneticalgo import GeneticAlgorithm
+from checkpoint import ResultStore, job_fingerprint
+from instrument import logger, metrics, reset_metrics
+
+AXES = ('row', 'column')
+
+
+def trajectory_jobs(desired_output, time_sequence=None, mask=None):
+    """
+    one independent fitting job per (object, axis), from DetectObject.row_data output or, with
+    time_sequence omitted, straight from a (frames x objects x 2) positions array.
+    mask is the (frames x objects) array from DetectObject.detect(..., return_masks=True); each job then scores
+    only the frames where its object was actually detected.
+    """
+    if time_sequence is None:
+        from detectobject import DetectObject
+        desired_output, time_sequence = DetectObject.trajectory_views(desired_output)
+    jobs = []
+    for index in range(len(desired_output)):
+        for axis, name in enumerate(AXES):
+            jobs.append({
+                "object": index,
+                "axis": name,
+                "time_value": time_sequence[index][axis],
+                "desired_output": desired_output[index][axis],
+            })
+            if mask is not None:
+                jobs[-1]["mask"] = mask[:, index]
+    return jobs
+
+
+def summarize(job, best_function):
+    summary = {
+        "object": job["object"],
+        "axis": job["axis"],
+        "best_function_expression": best_function.expression,
+        "best_function_instructions": best_function.instructions,
+        "score": best_function.score,
+        "track_str_infor": best_function.track,
+    }
+    if "fingerprint" in job:
+        summary["fingerprint"] = job["fingerprint"]
+    return summary
+
+
+def fit_job(job, ga_options, llm_factory=None, checkpoint_path=None, collect_metrics=False):
+    """
+    run one GA fit; module level so it can be sent to a worker process.
+    With collect_metrics the worker's metrics travel back in the result under "metrics".
+    """
+    llm = llm_factory() if llm_factory is not None else None
+    ga = GeneticAlgorithm(job["time_value"], job["desired_output"], llm=llm, checkpoint_path=checkpoint_path,
+                          mask=job.get("mask"), **ga_options)
+    result = summarize(job, ga.run())
+    if collect_metrics:
+        result["metrics"] = metrics.drain()
+    return result
+
+
+class FitScheduler:
+    """
+    run every (object, axis) fit concurrently and yield each result as soon as its job finishes.
+
+    mode='processes' spreads the jobs over a process pool so CPU-bound scoring uses every core; each worker
+    makes its own LLM calls, through llm_factory() (a picklable callable returning a callm.AsyncLLM) if given.
+    mode='threads' does the same on a thread pool.
+    mode='async' runs every job on one event loop sharing a single AsyncLLM, so its concurrency limit and
+    connections apply across all jobs.
+    With checkpoint_dir, every GA checkpoints its generations there and each finished result is appended to
+    results.jsonl; a later run with the same directory yields the stored results (marked "resumed") instead of
+    refitting those jobs, and resumes unfinished GAs from their last checkpoint. Results and checkpoints carry a
+    fingerprint of the job's data and the GA options (checkpoint.job_fingerprint), so a job whose trajectory,
+    mask or options changed is fitted afresh rather than resumed. Options with no stable description (e.g. a
+    lambda scorer) cannot be fingerprinted: those runs are neither checkpointed nor resumed, with a warning.
+    """
+    def __init__(self, workers=4, mode='processes', llm_factory=None, llm=None, checkpoint_dir=None, **ga_options):
+        if mode not in ('processes', 'threads', 'async'):
+            raise ValueError(f"Unsupported mode: {mode}")
+        self.workers = workers
+        self.mode = mode
+        self.llm_factory = llm_factory
+        self.llm = llm
+        self.checkpoint_dir = checkpoint_dir
+        self.ga_options = ga_options
+
+    def checkpoint_path(self, job):
+        if not self.checkpoint_dir or job.get("fingerprint") is None:
+            return None
+        return os.path.join(self.checkpoint_dir, f"object{job['object']}_{job['axis']}_{job['fingerprint']}.ckpt")
+
+    def run(self, jobs):
+        store = None
+        if self.checkpoint_dir:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            store = ResultStore(os.path.join(self.checkpoint_dir, "results.jsonl"))
+            jobs = [dict(job, fingerprint=job_fingerprint(job, self.ga_options)) for job in jobs]
+            if any(job["fingerprint"] is None for job in jobs):
+                logger.warning("The GA options cannot be fingerprinted (see checkpoint.describe_option), so these "
+                               "jobs are not checkpointed and stored results in %s are not reused",
+                               self.checkpoint_dir)
+            for job in jobs:
+                if store.is_finished(job):
+                    yield dict(store.finished[(job["object"], job["axis"])], resumed=True)
+            jobs = [job for job in jobs if not store.is_finished(job)]
+        for result in self._run(jobs):
+            if store is not None:
+                result = store.add(result)
+                path = self.checkpoint_path(result)
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+            yield result
+
+    def _run(self, jobs):
+        if self.mode == 'async':
+            yield from self._run_async(jobs)
+            return
+        if self.mode == 'processes':
+            executor = ProcessPoolExecutor(max_workers=self.workers, initializer=reset_metrics)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+        with executor:
+            futures = [executor.submit(fit_job, job, self.ga_options, self.llm_factory, self.checkpoint_path(job),
+                                       self.mode == 'processes')
+                       for job in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                if "metrics" in result:
+                    metrics.merge(result.pop("metrics"))
+                yield result
+
+    def _run_async(self, jobs):
+        if self.llm is None:
+            from callm import AsyncLLM
+            self.llm = self.llm_factory() if self.llm_factory is not None else AsyncLLM()
+
+        async def fit(job):
+            ga = GeneticAlgorithm(job["time_value"], job["desired_output"], llm=self.llm,
+                                  checkpoint_path=self.checkpoint_path(job), mask=job.get("mask"), **self.ga_options)
+            return summarize(job, await ga.run_async())
+
+        loop = asyncio.new_event_loop()
+        try:
+            pending = {loop.create_task(fit(job)) for job in jobs}
+            while pending:
+                done, pending = loop.run_until_complete(asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
@@ -0,0 +1,84 @@
+import numpy as np
+
+METRICS = ('rmse', 'mae', 'median_ae', 'huber', 'trimmed_rmse', 'max_error')
+
+
+def error_metrics(outputs, desired_output, mask=None, huber_delta=1.0, trim=0.1):
+    """
+    every metric in METRICS for every row of an outputs matrix, from one residual matrix and one sort.
+
+    :param outputs: (rows x points) candidate outputs, or a single row.
+    :param desired_output: the points to compare against.
+    :param mask: optional boolean array over the points; False points (e.g. frames padded or interpolated by
+                 DetectObject.fill_and_reorder_lists) are left out of every metric.
+    :param huber_delta: residual size at which the Huber loss turns from quadratic to linear.
+    :param trim: fraction of the largest residuals trimmed_rmse leaves out.
+    :return: a dict of metric name -> array with one value per row; a row with a non-finite output is inf everywhere.
+    """
+    outputs = np.atleast_2d(np.asarray(outputs, dtype=float))
+    desired_output = np.asarray(desired_output, dtype=float)
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+        outputs = outputs[:, mask]
+        desired_output = desired_output[mask]
+    with np.errstate(all='ignore'):
+        residuals = np.abs(outputs - desired_output)
+        finite = np.all(np.isfinite(residuals), axis=1)
+        residuals = np.sort(np.where(np.isfinite(residuals), residuals, np.inf), axis=1)
+        squared = residuals ** 2
+        points = residuals.shape[1]
+        keep = max(points - int(points * trim), 1)
+        middle = (points - 1) // 2
+        metrics = {
+            'rmse': np.sqrt(np.mean(squared, axis=1)),
+            'mae': np.mean(residuals, axis=1),
+            'median_ae': (residuals[:, middle] + residuals[:, points // 2]) / 2 if points else np.full(len(residuals), np.nan),
+            'huber': np.mean(np.where(residuals <= huber_delta, squared / 2, huber_delta * (residuals - huber_delta / 2)), axis=1),
+            'trimmed_rmse': np.sqrt(np.mean(squared[:, :keep], axis=1)),
+            'max_error': residuals[:, -1] if points else np.full(len(residuals), np.nan),
+        }
+    for name in metrics:
+        metrics[name] = np.where(finite, metrics[name], np.inf)
+    return metrics
+
+
+def similarity(errors):
+    """
+    map an error (0 is a perfect fit) to a similarity_score in (0, 1]; a non-finite error scores 0
+    """
+    with np.errstate(all='ignore'):
+        return np.where(np.isfinite(errors), 1 / (1 + errors), 0.0)
+
+
+class Scorer:
+    """
+    scores candidate outputs for selection: all of METRICS plus a similarity_score derived from score, which is
+    either a metric name (similarity_score = 1 / (1 + metric)) or a callable taking the dict of metric arrays and
+    returning one similarity per row, higher being better.
+
+    Scorer('huber', huber_delta=10) or Scorer('median_ae') keeps a few detection glitches from dominating the
+    score the way they dominate RMSE. A GeneticAlgorithm given a scorer uses it for selection and for the
+    scores recorded in every candidate's history.
+    """
+    def __init__(self, score='rmse', mask=None, huber_delta=1.0, trim=0.1):
+        if not callable(score) and score not in METRICS:
+            raise ValueError(f"Unsupported score: {score}")
+        self.score = score
+        self.mask = None if mask is None else np.asarray(mask, dtype=bool)
+        self.huber_delta = huber_delta
+        self.trim = trim
+        self.columns = METRICS + ('similarity_score',)
+
+    def masked(self, mask):
+        """
+        the same scorer restricted to the points where mask is True
+        """
+        return Scorer(self.score, mask, self.huber_delta, self.trim)
+
+    def __call__(self, outputs, desired_output):
+        """
+        :return: a (rows x columns) matrix, like function.score_outputs
+        """
+        metrics = error_metrics(outputs, desired_output, self.mask, self.huber_delta, self.trim)
+        scores = self.score(metrics) if callable(self.score) else similarity(metrics[self.score])
+        return np.column_stack([metrics[name] for name in METRICS] + [scores])
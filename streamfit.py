@@ -0,0 +1,182 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from detectobject import DetectObject, CircleTracker
+from geneticalgo import GeneticAlgorithm
+from scheduler import AXES, summarize
+from instrument import logger, metrics
+
+
+def fit_window(job, ga_options, llm_factory=None, population=None):
+    """
+    fit one (object, axis) window, warm-started from population when given.
+    :return: the summary dict (with the best Function under "function") and the final population, best first
+    """
+    llm = llm_factory() if llm_factory is not None else None
+    ga = GeneticAlgorithm(job["time_value"], job["desired_output"], llm=llm, initial_population=population, **ga_options)
+    best = ga.run()
+    result = dict(summarize(job, best), function=best, frames=(int(job["time_value"][0]), int(job["time_value"][-1])))
+    return result, sorted(ga.population, key=lambda func: func.score, reverse=True)
+
+
+class StreamFitter:
+    """
+    online version of the detect -> fit pipeline for live video. Each update(frame) detects the shape in that
+    frame (circles frame to frame with a CircleTracker), matches the detections to the known objects by
+    minimum total distance and appends them to a sliding window of the last window frames per object.
+
+    Every refit_every frames each (object, axis) window is refitted on a background worker, warm-started from
+    the previous window's surviving population so only the first fit of an object asks the LLM for an initial
+    population. update() never waits for a fit: a window whose previous fit is still running is skipped, so the
+    time per frame stays bounded by detection and matching however slow the GA is, and fits holds the latest
+    finished fit per (object, axis).
+
+    Time values are the 1-based frame numbers, as in DetectObject.trajectory_views, so a fitted function keeps
+    describing the same trajectory as the window slides. Frames where an object was not seen are simply missing
+    from its window instead of being padded.
+    """
+    def __init__(self, detector=None, shape='circle', window=90, refit_every=15, min_points=10, max_distance=None,
+                 max_missing=None, workers=2, llm_factory=None, tracking=True, population_size=6, generations=2,
+                 **ga_options):
+        self.detector = detector if detector is not None else DetectObject()
+        if shape not in self.detector.detectors:
+            raise ValueError(f"Unsupported shape type: {shape}")
+        self.shape = shape
+        self.window = window
+        self.refit_every = refit_every
+        self.min_points = min_points
+        self.max_distance = max_distance  # detections farther than this from every object start a new object
+        self.max_missing = max_missing if max_missing is not None else window  # frames before an object is dropped
+        self.llm_factory = llm_factory
+        self.ga_options = dict(ga_options, population_size=population_size, generations=generations)
+        self.tracker = CircleTracker(self.detector, **(tracking if isinstance(tracking, dict) else {})) \
+            if tracking and shape == 'circle' else None
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.frame_index = 0
+        self.objects = {}  # object id -> deque of (frame number, x, y)
+        self.last_seen = {}
+        self.next_object = 0
+        self.populations = {}  # (object, axis) -> survivors of the last finished fit
+        self.fits = {}  # (object, axis) -> latest finished fit summary
+        self.pending = {}  # (object, axis) -> future of the fit in flight
+
+    def detect(self, frame):
+        if self.tracker is not None:
+            return self.tracker.update(frame)
+        return self.detector.detect_shapes_in_image(frame, [self.shape])[self.shape]
+
+    def match(self, detections, frame_number):
+        """
+        assign this frame's detections to objects with the Hungarian algorithm on the distance to each
+        object's last position
+        """
+        from scipy.optimize import linear_sum_assignment
+        from scipy.spatial.distance import cdist
+
+        ids = list(self.objects)
+        unmatched = list(range(len(detections)))
+        if ids and detections:
+            last = np.array([self.objects[obj][-1][1:] for obj in ids], dtype=float)
+            distances = cdist(np.asarray(detections, dtype=float), last)
+            for row, col in zip(*linear_sum_assignment(distances)):
+                if self.max_distance is not None and distances[row, col] > self.max_distance:
+                    continue
+                self.objects[ids[col]].append((frame_number, *detections[row]))
+                self.last_seen[ids[col]] = frame_number
+                unmatched.remove(row)
+        for row in unmatched:
+            self.objects[self.next_object] = deque([(frame_number, *detections[row])], maxlen=self.window)
+            self.last_seen[self.next_object] = frame_number
+            self.next_object += 1
+        for obj in [obj for obj, seen in self.last_seen.items() if frame_number - seen > self.max_missing]:
+            del self.objects[obj], self.last_seen[obj]
+            for axis in AXES:
+                self.populations.pop((obj, axis), None)
+                self.fits.pop((obj, axis), None)
+
+    def collect(self):
+        """
+        move finished fits into fits and populations without waiting for running ones
+        """
+        for key, future in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[key]
+            try:
+                result, population = future.result()
+            except Exception as error:
+                logger.warning("Fit of object %d %s failed: %s", key[0], key[1], error)
+                metrics.count("stream_fit_failures")
+                continue
+            if key[0] not in self.objects:
+                continue  # the object was dropped while its fit was running
+            self.fits[key] = result
+            self.populations[key] = population[:self.ga_options["population_size"]]
+            metrics.count("stream_fits")
+
+    def schedule(self):
+        for obj, points in self.objects.items():
+            if len(points) < self.min_points:
+                continue
+            window = np.array(points, dtype=float)
+            for axis, name in enumerate(AXES):
+                key = (obj, name)
+                if key in self.pending:
+                    metrics.count("stream_fits_skipped")
+                    continue
+                job = {"object": obj, "axis": name, "time_value": window[:, 0], "desired_output": window[:, axis + 1]}
+                self.pending[key] = self.executor.submit(fit_window, job, self.ga_options, self.llm_factory,
+                                                         self.populations.get(key))
+
+    def update(self, frame):
+        """
+        consume one frame.
+        :return: the latest finished fit per (object, axis)
+        """
+        with metrics.timer("stream_update"):
+            self.frame_index += 1
+            self.match(self.detect(frame), self.frame_index)
+            self.collect()
+            if self.frame_index % self.refit_every == 0:
+                self.schedule()
+        return self.fits
+
+    def run(self, frames):
+        """
+        :return: a generator of (frame number, latest fits) for each frame of any frame iterable,
+                 e.g. a framesource.VideoSource
+        """
+        try:
+            for frame in frames:
+                yield self.frame_index + 1, self.update(frame)
+        finally:
+            self.close()
+
+    def predict(self, frame_number=None):
+        """
+        evaluate the latest fits at frame_number (the current frame by default).
+        :return: {object: (x, y)} for every object with both axes fitted
+        """
+        frame_number = self.frame_index if frame_number is None else frame_number
+        positions = {}
+        for obj in {obj for obj, _ in self.fits}:
+            if all((obj, axis) in self.fits for axis in AXES):
+                positions[obj] = tuple(float(self.fits[(obj, axis)]["function"].calculate([frame_number])[0])
+                                       for axis in AXES)
+        return positions
+
+    def close(self, wait=True):
+        self.executor.shutdown(wait=wait)
+        self.collect()
+
+
+if __name__ == "__main__":
+    from framesource import VideoSource
+
+    video_path = '<insert your video file path>'
+    fitter = StreamFitter(window=90, refit_every=15)
+    for frame_number, fits in fitter.run(VideoSource(video_path)):
+        if frame_number % fitter.refit_every == 0:
+            for (obj, axis), fit in sorted(fits.items()):
+                print(f"frame {frame_number} object {obj} {axis}: y = {fit['best_function_expression']} "
+                      f"(frames {fit['frames'][0]}-{fit['frames'][1]}, score {fit['score']:.4g})")
@@ -0,0 +1,48 @@
+import asyncio
+import time
+from callm import AsyncLLM, LLMCache, split_batch_reply
+from run_benchmarks import StubTransport
+
+
+def store(cache, prompt, response):
+    key, sample, _ = cache.lookup("model", [prompt])
+    cache.store(key, sample, response)
+    time.sleep(0.01)  # keep the accessed timestamps apart
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = LLMCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    store(cache, "a", "1")
+    store(cache, "b", "2")
+    assert cache.lookup("model", ["a"])[2] == "1"  # a is now used more recently than b
+    time.sleep(0.01)
+    store(cache, "c", "3")
+    assert cache.lookup("model", ["b"])[2] is None
+    assert cache.lookup("model", ["a"])[2] == "1"
+    assert cache.lookup("model", ["c"])[2] == "3"
+
+
+def test_eviction_by_size(tmp_path):
+    cache = LLMCache(str(tmp_path / "cache.sqlite"), max_entries=None, max_bytes=10)
+    store(cache, "a", "x" * 6)
+    store(cache, "b", "y" * 6)
+    assert cache.lookup("model", ["a"])[2] is None
+    assert cache.lookup("model", ["b"])[2] == "y" * 6
+
+
+def test_initial_generations_are_distinct_and_cached(tmp_path):
+    transport = StubTransport(0)
+    llm = AsyncLLM(transport, retries=0, batch_size=2, cache=LLMCache(str(tmp_path / "cache.sqlite")))
+    first = asyncio.run(llm.initial_generations("[1.0, 2.0]", 4))
+    requests = transport.calls
+    assert asyncio.run(llm.initial_generations("[1.0, 2.0]", 4)) == first
+    assert transport.calls == requests
+    assert len(set(first)) > 1
+
+
+def test_split_batch_reply():
+    reply = "```\n1: add_instruction(1, 'y = y + 1')\n3) remove_instruction(1)\n```"
+    assert split_batch_reply(reply, 3) == ["add_instruction(1, 'y = y + 1')", None, "remove_instruction(1)"]
+    assert split_batch_reply("a\nb", 2) == ["a", "b"]
+    assert split_batch_reply("a\nb", 3) == [None, None, None]
+    assert split_batch_reply(None, 1) == [None]
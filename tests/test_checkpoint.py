@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import numpy as np
+from callm import AsyncLLM
+from checkpoint import describe_option, job_fingerprint
+from geneticalgo import GeneticAlgorithm
+from scheduler import FitScheduler
+from scoring import Scorer, similarity
+from run_benchmarks import ROOT, StubTransport
+
+X = np.arange(1, 31, dtype=float)
+Y = 0.5 * X ** 2 + 3
+
+
+def make_llm():
+    return AsyncLLM(StubTransport(0), retries=0)
+
+
+def test_ga_resumes_from_its_checkpoint(tmp_path):
+    path = str(tmp_path / "run.ckpt")
+    first = GeneticAlgorithm(X, Y, 6, 2, llm=make_llm(), checkpoint_path=path)
+    first.run()
+    resumed = GeneticAlgorithm(X, Y, 6, 4, llm=make_llm(), checkpoint_path=path)
+    assert resumed.restore_checkpoint() == 2
+    assert [func.instructions for func in resumed.population] == [func.instructions for func in first.population]
+    resumed.run()
+    assert len(resumed.generation_scores) == 4
+
+
+def test_scheduler_reuses_only_results_with_a_matching_fingerprint(tmp_path):
+    jobs = [{"object": 0, "axis": axis, "time_value": X, "desired_output": Y} for axis in ("row", "column")]
+    options = dict(workers=2, mode='threads', llm_factory=make_llm, checkpoint_dir=str(tmp_path), population_size=4)
+    assert not any(result.get("resumed") for result in FitScheduler(generations=2, **options).run(jobs))
+    assert all(result.get("resumed") for result in FitScheduler(generations=2, **options).run(jobs))
+    assert not any(result.get("resumed") for result in FitScheduler(generations=3, **options).run(jobs))
+    assert os.listdir(tmp_path) == ["results.jsonl"]  # checkpoints of finished jobs are removed
+
+
+def test_fingerprint_is_the_same_in_every_process():
+    code = ("import numpy as np; from checkpoint import job_fingerprint; from mutation import MixedMutator; "
+            "from scoring import Scorer, similarity; x = np.arange(1, 31.0); "
+            "print(job_fingerprint({'time_value': x, 'desired_output': x * 2}, "
+            "{'mutator': MixedMutator(llm_every=2), 'scorer': Scorer(similarity), 'population_size': 6}))")
+    fingerprints = {subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                                   check=True).stdout.strip() for _ in range(2)}
+    assert len(fingerprints) == 1 and fingerprints != {"None"}
+
+
+def test_options_without_a_stable_description_are_not_fingerprinted():
+    assert describe_option(similarity) == "scoring.similarity"
+    job = {"time_value": X, "desired_output": Y}
+    assert job_fingerprint(job, {"scorer": Scorer(lambda metrics: similarity(metrics["mae"]))}) is None
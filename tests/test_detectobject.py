@@ -0,0 +1,19 @@
+from detectobject import DetectObject
+
+
+def test_missing_detections_in_the_first_and_last_frames_are_filled():
+    filled = DetectObject.fill_and_reorder_lists([[(1, 1), (50, 50)], [(2, 2), (51, 51)], [(3, 3)]])
+    assert filled == [[(1, 1), (50, 50)], [(2, 2), (51, 51)], [(3, 3), (51, 51)]]
+    filled = DetectObject.fill_and_reorder_lists([[(1, 1)], [(2, 2), (51, 51)], [(3, 3), (53, 53)]])
+    assert filled[0] == [(1, 1), (51, 51)]
+
+
+def test_gaps_are_interpolated_from_the_nearest_detections():
+    filled = DetectObject.fill_and_reorder_lists([[(0, 10), (40, 40)], [(1, 11)], [(2, 12)], [(3, 13), (46, 46)]])
+    assert [frame[1] for frame in filled] == [(40, 40), (43.0, 43.0), (43.0, 43.0), (46, 46)]
+
+
+def test_mask_marks_padded_and_interpolated_positions():
+    _, mask = DetectObject.fill_and_reorder_lists(
+        [[(0, 10), (40, 40)], [(1, 11)], [(2, 12)], [(3, 13), (46, 46)]], return_mask=True)
+    assert mask.tolist() == [[True, True], [True, False], [True, False], [True, True]]
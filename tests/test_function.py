@@ -0,0 +1,48 @@
+import numpy as np
+from function import Function, canonical_program, compile_instruction, execute_program, fit_program_constants
+
+
+def compiled(*instructions):
+    return [compile_instruction(instruction) for instruction in instructions]
+
+
+def test_calculate_returns_a_copy_of_the_cached_result():
+    func = Function(['y = x', 'y = y * 2'], '')
+    x = np.arange(3, dtype=float)
+    func.calculate(x)[:] = 99
+    assert func.calculate(x).tolist() == [0, 2, 4]
+
+
+def test_affine_tail_is_fitted_in_closed_form():
+    x = np.arange(1, 21, dtype=float)
+    fitted = fit_program_constants(compiled('y = y * 1', 'y = y + 1'), x, 3 * x - 7, max_nfev=1)
+    assert fitted is not None
+    assert np.allclose(execute_program(fitted, x), 3 * x - 7)
+
+
+def test_fit_that_does_not_help_is_rejected():
+    x = np.arange(1, 11, dtype=float)
+    assert fit_program_constants(compiled('y = y * 2'), x, 2 * x) is None
+    assert fit_program_constants(compiled('y = sin(y)'), x, x) is None
+
+
+def test_overflowing_program_is_not_fitted():
+    x = np.arange(1, 31, dtype=float)
+    program = compiled('y = y ^ 4', 'y = y + 2', 'y = y ^ 4', 'y = y + 1', 'y = y ^ 3')
+    assert fit_program_constants(program, x, 3 * x) is None
+
+
+def test_canonical_program_merges_equivalent_programs():
+    assert canonical_program(compiled('y = y - 2', 'y = y / 4')) == canonical_program(compiled('y = y + -2', 'y = y * 0.25'))
+    assert canonical_program(compiled('y = y + 0', 'y = y * 1', 'y = y ^ 1', 'y = y - 0')) == ()
+    assert canonical_program(compiled('y = y * 2')) != canonical_program(compiled('y = y * 3'))
+
+
+def test_masked_points_are_left_out_of_the_fit():
+    x = np.arange(1, 21, dtype=float)
+    desired = 3 * x + 2
+    desired[[0, -1]] = 500
+    mask = np.ones(len(x), dtype=bool)
+    mask[[0, -1]] = False
+    fitted = fit_program_constants(compiled('y = y * 1', 'y = y + 1'), x, desired, mask=mask)
+    assert np.allclose(execute_program(fitted, x), 3 * x + 2)
@@ -0,0 +1,27 @@
+import numpy as np
+from callm import AsyncLLM
+from geneticalgo import GeneticAlgorithm
+from run_benchmarks import StubTransport
+
+X = np.arange(1, 31, dtype=float)
+Y = 0.5 * X ** 2 + 3
+
+
+def test_llm_budget_bounds_the_initial_population_too():
+    transport = StubTransport(0)
+    ga = GeneticAlgorithm(X, Y, 6, 3, llm=AsyncLLM(transport, retries=0), llm_budget=3)
+    ga.run()
+    assert transport.calls == ga.llm_calls == 3
+    assert ga.stop_reason == "used the budget of 3 LLM calls"
+
+
+def test_resumed_run_keeps_its_early_stopping_state(tmp_path):
+    path = str(tmp_path / "run.ckpt")
+    first = GeneticAlgorithm(X, Y, 6, 2, llm=AsyncLLM(StubTransport(0), retries=0), checkpoint_path=path,
+                             patience=10)
+    first.run()
+    resumed = GeneticAlgorithm(X, Y, 6, 4, llm=AsyncLLM(StubTransport(0), retries=0), checkpoint_path=path,
+                               patience=10)
+    resumed.restore_checkpoint()
+    assert resumed.llm_calls == first.llm_calls > 0
+    assert (resumed.best_score, resumed.stale_generations) == (first.best_score, first.stale_generations)
@@ -0,0 +1,16 @@
+import subprocess
+import sys
+from run_benchmarks import IMPORT_MODULES, ROOT, bench_imports, check_import_budget
+
+IMPORT_BUDGET = 0.5  # seconds, as in the benchmarks' --import-budget example
+
+
+def test_imports_stay_within_budget():
+    assert check_import_budget(bench_imports(repeat=3), IMPORT_BUDGET)
+
+
+def test_heavy_dependencies_are_imported_on_first_use():
+    code = ("import sys; import " + ", ".join(IMPORT_MODULES) +
+            "; print(sorted(name for name in ('openai', 'scipy') if name in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
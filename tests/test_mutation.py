@@ -0,0 +1,41 @@
+from function import Function
+from mutation import Mutation, parse_mutation
+
+
+def function():
+    return Function(['y = x', 'y = y + 1', 'y = y * 2'], '')
+
+
+def test_plain_and_prefixed_calls():
+    assert parse_mutation("add_instruction(2, 'y = y + 3')") == Mutation('add_instruction', 2, 'y = y + 3')
+    assert parse_mutation("function.remove_instruction(1)") == Mutation('remove_instruction', 1, None)
+
+
+def test_fenced_reply_with_a_language_tag():
+    reply = "```python\nsubstitute_instruction(2, 'y = cos(y)')\n```"
+    assert parse_mutation(reply) == Mutation('substitute_instruction', 2, 'y = cos(y)')
+
+
+def test_call_inside_prose():
+    reply = "The best next step is add_instruction(3, 'y = log(y)'). It should help."
+    assert parse_mutation(reply) == Mutation('add_instruction', 3, 'y = log(y)')
+
+
+def test_json_reply():
+    reply = '```json\n{"operation": "substitute_instruction", "index": 1, "instruction": "y = sin(y)"}\n```'
+    assert parse_mutation(reply) == Mutation('substitute_instruction', 1, 'y = sin(y)')
+    assert parse_mutation('{"operation": "remove_instruction", "index": 2}') == Mutation('remove_instruction', 2, None)
+
+
+def test_out_of_range_index_is_invalid():
+    assert not parse_mutation("remove_instruction(3)").is_valid_for(function())
+    assert not parse_mutation("substitute_instruction(0, 'y = y + 1')").is_valid_for(function())
+    assert parse_mutation("add_instruction(3, 'y = y + 1')").is_valid_for(function())
+
+
+def test_invalid_replies():
+    assert not parse_mutation("add_instruction(1, 'y = y +')").is_valid_for(function())
+    assert parse_mutation("delete_instruction(1)") is None
+    assert parse_mutation("add_instruction('one', 'y = y + 1')") is None
+    assert parse_mutation("__import__('os').system('true')") is None
+    assert parse_mutation("I am not sure (sorry).") is None